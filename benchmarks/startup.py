@@ -0,0 +1,96 @@
+"""Startup time of the application.
+
+Cold start runs imports and `init_app` in a fresh interpreter with an
+empty swagger cache, warm start repeats `init_app` in a process which
+already has everything imported and cached. Needs the database from
+the given config to be up, config/memory_config.toml needs none.
+
+    $ python benchmarks/startup.py -c config/test_config.toml -n 10
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COLD_START = '''
+import asyncio, sys, time
+start = time.perf_counter()
+from forum.main import init_app
+from forum.settings import load_config
+config = load_config(sys.argv[1])
+config['swagger'] = {'CACHE_DIR': sys.argv[2]}
+async def start_app():
+    app = await init_app(config)
+    started = time.perf_counter()
+    app['swagger'].load()
+    loaded = time.perf_counter()
+    await app['db_pool'].close()
+    return started, loaded
+started, loaded = asyncio.get_event_loop().run_until_complete(start_app())
+print(started - start, loaded - started)
+'''
+
+
+def cold_start(config_path, cache_dir):
+    output = subprocess.check_output(
+        [sys.executable, '-c', COLD_START, config_path, cache_dir],
+        cwd=ROOT)
+    return [float(value) for value in output.split()]
+
+
+async def warm_start(config, times):
+    from forum.main import init_app
+
+    result = []
+    for _ in range(times):
+        start = time.perf_counter()
+        app = await init_app(config)
+        started = time.perf_counter()
+        app['swagger'].load()
+        result.append((started - start, time.perf_counter() - started))
+        await app['db_pool'].close()
+    return result
+
+
+def report(name, timings):
+    for column, title in enumerate(('init_app', 'swagger spec')):
+        values = [timing[column] * 1000 for timing in timings]
+        print('{:<6} {:<13} median {:8.2f} ms   min {:8.2f} ms'.format(
+            name, title, statistics.median(values), min(values)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time benchmark')
+    parser.add_argument('-c', '--config', default='config/test_config.toml')
+    parser.add_argument('-n', '--number', type=int, default=10)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from forum.settings import load_config
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold = []
+        for _ in range(args.number):
+            # every cold run gets its own empty cache
+            run_cache_dir = tempfile.mkdtemp(dir=cache_dir)
+            cold.append(cold_start(args.config, run_cache_dir))
+
+        config = load_config(os.path.join(ROOT, args.config))
+        config['swagger'] = {'CACHE_DIR': cache_dir}
+        loop = asyncio.get_event_loop()
+        # first start fills the swagger cache and is not counted
+        loop.run_until_complete(warm_start(config, 1))
+        warm = loop.run_until_complete(warm_start(config, args.number))
+
+    report('cold', cold)
+    report('warm', warm)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,12 @@
-from sqlalchemy import create_engine, MetaData
+import time
+
+from sqlalchemy import create_engine, text, MetaData
 
 from forum.db import construct_db_url
-from forum.models import user, topic, thread, message
-from forum.security import generate_password_hash
+from forum.models import (
+    user, topic, thread, message, message_archive, read_marker, topic_stats
+)
+from forum.sample_data import sample_data
 from forum.settings import load_config
 
 
@@ -50,111 +54,140 @@ def create_tables(target_config=None):
     engine = get_engine(target_config)
 
     meta = MetaData()
-    meta.create_all(bind=engine, tables=[user, topic, thread, message])
+    meta.create_all(bind=engine, tables=[user, topic, thread])
+
+    partitions = target_config.get('MESSAGE_PARTITIONS')
+    if partitions:
+        create_partitioned_message_table(engine, partitions)
+    else:
+        meta.create_all(bind=engine, tables=[message])
+
+    meta.create_all(bind=engine,
+                    tables=[message_archive, read_marker, topic_stats])
+
+
+def create_partitioned_message_table(engine, partitions):
+    """Message table hash partitioned by thread (PostgreSQL 11+).
+    Primary key has to include the partition key and self-referencing
+    foreign key of parent is not possible on a partitioned table.
+    """
+    with engine.connect() as conn:
+        conn.execute("""
+          CREATE TABLE message (
+            id SERIAL,
+            content TEXT NOT NULL,
+            thread INTEGER NOT NULL REFERENCES thread (id),
+            parent INTEGER,
+            starter BOOLEAN NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (thread, id)
+          ) PARTITION BY HASH (thread)""")
+        for remainder in range(partitions):
+            conn.execute("""
+              CREATE TABLE message_%s PARTITION OF message
+              FOR VALUES WITH (MODULUS %s, REMAINDER %s)""" %
+                         (remainder, partitions, remainder))
 
 
 def drop_tables(target_config=None):
     engine = get_engine(target_config)
 
     meta = MetaData()
-    meta.drop_all(bind=engine, tables=[user, topic, thread, message])
+    meta.drop_all(bind=engine, tables=[
+        user, topic, thread, message, message_archive, read_marker,
+        topic_stats
+    ])
+
+
+# threads are walked by id with a keyset cursor, inactivity is checked
+# on the last message of each thread through (thread, id) index
+ARCHIVE_BATCH = """
+  WITH batch AS (
+    SELECT id FROM thread
+    WHERE id > :after
+    ORDER BY id
+    LIMIT :limit
+  ), inactive AS (
+    SELECT batch.id FROM batch
+    WHERE (SELECT message.created_at FROM message
+           WHERE message.thread = batch.id
+           ORDER BY message.id DESC
+           LIMIT 1) < now() - make_interval(days => :days)
+  ), moved AS (
+    DELETE FROM message
+    WHERE thread IN (SELECT id FROM inactive)
+    RETURNING id, content, thread, parent, starter, created_at, updated_at
+  ), archived AS (
+    INSERT INTO message_archive
+    SELECT * FROM moved
+    RETURNING id
+  )
+  SELECT (SELECT max(id) FROM batch) AS last_thread,
+         (SELECT count(*) FROM archived) AS archived"""
+
+
+def archive_threads(target_config=None, inactive_days=365,
+                    batch_size=100, batch_delay=0.5):
+    """Move messages of threads without new messages for `inactive_days`
+    to message_archive, a batch of threads per transaction.
+    """
+    engine = get_engine(target_config)
+    archived = 0
+    last_thread = 0
+
+    with engine.connect() as conn:
+        while True:
+            row = conn.execute(text(ARCHIVE_BATCH), after=last_thread,
+                               limit=int(batch_size),
+                               days=int(inactive_days)).first()
+            if row['last_thread'] is None:
+                return archived
+            last_thread = row['last_thread']
+            archived += row['archived']
+            if row['archived']:
+                time.sleep(batch_delay)
+
+
+def reconcile_stats(target_config=None):
+    """Recount topic stats from thread and message tables, return
+    number of topics whose counters had drifted.
+    """
+    engine = get_engine(target_config)
+
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='READ COMMITTED')
+        with conn.begin():
+            # writers wait until the counts are replaced, increments
+            # of transactions still running are applied after that
+            conn.execute("LOCK TABLE topic_stats IN EXCLUSIVE MODE")
+            result = conn.execute("""
+              INSERT INTO topic_stats (topic, threads, messages)
+              SELECT topic.id,
+                (SELECT count(*) FROM thread
+                 WHERE thread.topic = topic.id),
+                (SELECT count(*) FROM message
+                 JOIN thread ON thread.id = message.thread
+                 WHERE thread.topic = topic.id) +
+                (SELECT count(*) FROM message_archive
+                 JOIN thread ON thread.id = message_archive.thread
+                 WHERE thread.topic = topic.id)
+              FROM topic
+              ON CONFLICT (topic) DO UPDATE
+              SET threads = EXCLUDED.threads, messages = EXCLUDED.messages
+              WHERE (topic_stats.threads, topic_stats.messages)
+                IS DISTINCT FROM (EXCLUDED.threads, EXCLUDED.messages)""")
+            return result.rowcount
 
 
 def create_sample_data(target_config=None):
     engine = get_engine(target_config)
 
     with engine.connect() as conn:
-        conn.execute(user.insert(), [
-            {
-                'username': 'admin',
-                'password_hash': generate_password_hash('admin'),
-                'superuser': True
-            },
-            {
-                'username': 'guest',
-                'password_hash': generate_password_hash('guest'),
-                'superuser': False
-            },
-        ])
-        conn.execute(topic.insert(), [
-            {'name': 'Cinema'},
-            {'name': 'Music'},
-            {'name': 'Sport'},
-        ])
-        conn.execute(thread.insert(), [
-            {
-                'title': 'Luc Besson cinematography',
-                'topic': 1,
-                'created_at': '2001-01-01 00:00:00'
-            },
-            {
-                'title': 'Madagascar movie',
-                'topic': 1,
-                'created_at': '2001-01-01 00:00:00'
-            },
-            {
-                'title': 'Hard Rock music',
-                'topic': 2,
-                'created_at': '2001-01-01 00:00:00'
-            },
-            {
-                'title': "You'll never walk alone!",
-                'topic': 3,
-                'created_at': '2001-01-01 00:00:00'
-             },
-        ])
-        conn.execute(message.insert(), [
-            {
-                'content': 'Le Grand Bleu - the most wonderful movie',
-                'thread': 1,
-                'parent': None,
-                'starter': True,
-                'created_at': '2001-03-14 11:15:01',
-                'updated_at': '2001-03-14 11:15:01'
-            }
-        ])
-        conn.execute(message.insert(), [
-            {
-                'content': 'Yes! But Leon is the most dramatic',
-                'thread': 1,
-                'parent': 1,
-                'starter': False,
-                'created_at': '2001-03-14 11:17:12',
-                'updated_at': '2001-03-14 11:17:12'
-            },
-            {
-                'content': 'Remember the Fifth Element',
-                'thread': 1,
-                'parent': None,
-                'starter': False,
-                'created_at': '2001-03-14 11:39:21',
-                'updated_at': '2001-03-14 11:39:21'
-            },
-            {
-                'content': 'Pinguins are coming',
-                'thread': 2,
-                'parent': None,
-                'starter': True,
-                'created_at': '2001-04-21 13:12:21',
-                'updated_at': '2001-04-21 13:12:21'
-            },
-            {
-                'content': 'Hard Rock forever!',
-                'thread': 3,
-                'parent': None,
-                'starter': True,
-                'created_at': '2001-04-21 13:13:21',
-                'updated_at': '2001-04-21 13:13:21'
-            },
-            {
-                'content': 'Liverpool is the champion!!!',
-                'thread': 4,
-                'parent': None,
-                'starter': 1,
-                'created_at': '2011-06-01 23:33:21',
-                'updated_at': '2011-06-01 23:33:21'
-            },
-        ])
+        for table, rows in sample_data():
+            conn.execute(table.insert(), rows)
+    # sample rows are inserted directly, not by the counting queries
+    reconcile_stats(target_config=target_config)
 
 
 if __name__ == '__main__':
@@ -175,6 +208,11 @@ if __name__ == '__main__':
     parser.add_argument("-a", "--all",
                         help="Create sample data",
                         action='store_true')
+    parser.add_argument("--archive", metavar='DAYS', type=int,
+                        help="Archive threads inactive for DAYS days")
+    parser.add_argument("--reconcile-stats",
+                        help="Recount topic stats to fix drifted counters",
+                        action='store_true')
     args = parser.parse_args()
 
     if args.create:
@@ -195,5 +233,12 @@ if __name__ == '__main__':
                  target_config=user_db_config)
         create_tables(target_config=user_db_config)
         create_sample_data(target_config=user_db_config)
+    elif args.archive:
+        count = archive_threads(target_config=user_db_config,
+                                inactive_days=args.archive)
+        print('%s messages archived' % count)
+    elif args.reconcile_stats:
+        count = reconcile_stats(target_config=user_db_config)
+        print('%s topic stats fixed' % count)
     else:
         parser.print_help()
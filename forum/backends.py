@@ -0,0 +1,18 @@
+import importlib
+
+DEFAULT_BACKEND = 'postgres'
+
+# every backend module implements init_db and the query functions
+# of forum.db with the same signatures and results
+BACKENDS = {
+    'postgres': 'forum.db',
+    'memory': 'forum.memory_db',
+}
+
+
+def get_backend(config):
+    """Storage module selected by BACKEND in [database] section"""
+    name = config['database'].get('BACKEND', DEFAULT_BACKEND)
+    if name not in BACKENDS:
+        raise ValueError('Unknown database backend: {}'.format(name))
+    return importlib.import_module(BACKENDS[name])
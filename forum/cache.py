@@ -0,0 +1,115 @@
+import asyncio
+from collections import OrderedDict
+
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+
+
+class PageCache:
+    """LRU cache of serialized pages bounded by their total size in bytes.
+
+    Concurrent misses of the same key share a single load, a key
+    invalidated during the load does not get the stale result stored.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.pages = OrderedDict()
+        self.loading = {}
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def get(self, key):
+        page = self.pages.get(key)
+        if page is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self.pages.move_to_end(key)
+        return page
+
+    def put(self, key, page):
+        if len(page) > self.max_size:
+            return
+        self.invalidate(key, count=False)
+        self.pages[key] = page
+        self.size += len(page)
+        while self.size > self.max_size:
+            _, evicted = self.pages.popitem(last=False)
+            self.size -= len(evicted)
+            self.stats['evictions'] += 1
+
+    def invalidate(self, key, count=True):
+        self.loading.pop(key, None)
+        page = self.pages.pop(key, None)
+        if page is not None:
+            self.size -= len(page)
+            if count:
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        self.loading.clear()
+        self.pages.clear()
+        self.size = 0
+
+    async def get_or_load(self, key, load):
+        """Get page from cache or from `load()` coroutine.
+        None returned by `load` means there is no page and is not cached.
+        """
+        page = self.get(key)
+        if page is not None:
+            return page
+
+        future = self.loading.get(key)
+        if future is not None:
+            self.stats['coalesced'] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # request which was loading the page has gone, load again
+                return await self.get_or_load(key, load)
+
+        future = asyncio.get_event_loop().create_future()
+        self.loading[key] = future
+        try:
+            page = await load()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # waiters get the exception, nobody else has to retrieve it
+            future.exception()
+            raise
+        else:
+            future.set_result(page)
+        finally:
+            if self.loading.get(key) is future:
+                del self.loading[key]
+                if page is not None:
+                    self.put(key, page)
+        return page
+
+    def metrics(self):
+        requests = self.stats['hits'] + self.stats['misses']
+        return dict(
+            self.stats,
+            hit_ratio=self.stats['hits'] / requests if requests else 0.0,
+            entries=len(self.pages),
+            size=self.size,
+            max_size=self.max_size,
+        )
+
+
+def setup_cache(app):
+    config = app['config'].get('cache', {})
+    cache = PageCache(config.get('THREAD_CACHE_SIZE', DEFAULT_MAX_SIZE))
+    app['thread_cache'] = cache
+    app['metrics']['thread_cache'] = cache.metrics
@@ -1,15 +1,40 @@
 import asyncio
 from datetime import datetime
 
+from asyncpg.exceptions import ForeignKeyViolationError
 import asyncpgsa
+from sqlalchemy import (
+    select, func, and_, union_all, any_, bindparam, Integer
+)
+from sqlalchemy.dialects.postgresql import ARRAY
 
-from forum.models import user, topic, thread, message
+from forum.models import (
+    user, topic, thread, message, message_archive, read_marker, topic_stats
+)
+from forum.tracing import tracing_connection_class
+
+
+DEFAULT_POOL_MIN_SIZE = 10
+DEFAULT_POOL_MAX_SIZE = 10
 
 
 async def init_db(app):
-    dsn = construct_db_url(app['config']['database'])
-    pool = await asyncpgsa.create_pool(dsn=dsn)
+    config = app['config']['database']
+    dsn = construct_db_url(config)
+    pool_size = {
+        'min_size': config.get('POOL_MIN_SIZE', DEFAULT_POOL_MIN_SIZE),
+        'max_size': config.get('POOL_MAX_SIZE', DEFAULT_POOL_MAX_SIZE),
+    }
+    tracer = app.get('query_tracer')
+    if tracer:
+        pool = await asyncpgsa.create_pool(
+            dsn=dsn, connection_class=tracing_connection_class(tracer),
+            **pool_size)
+        tracer.pool = pool
+    else:
+        pool = await asyncpgsa.create_pool(dsn=dsn, **pool_size)
     app['db_pool'] = pool
+    app['db_min_size'] = pool_size['min_size']
     return pool
 
 
@@ -40,12 +65,26 @@ async def create_user(conn, username, password_hash):
     await asyncio.shield(conn.execute(stmt))
 
 
+# hidden flag is internal, topics are always returned without it
+TOPIC_COLUMNS = [topic.c.id, topic.c.name, topic.c.parent]
+
+
+def topic_subtree(topic_id):
+    """Recursive CTE with ids of the topic and all its nested topics"""
+    tree = select([topic.c.id]).where(
+        topic.c.id == topic_id).cte('tree', recursive=True)
+    return tree.union_all(
+        select([topic.c.id]).where(topic.c.parent == tree.c.id))
+
+
 async def get_topics(conn):
-    return await conn.fetch(topic.select())
+    stmt = select(TOPIC_COLUMNS).where(topic.c.hidden.is_(False))
+    return await conn.fetch(stmt)
 
 
 async def get_topic_by_id(conn, topic_id):
-    stmt = topic.select().where(topic.c.id == topic_id)
+    stmt = select(TOPIC_COLUMNS).where(topic.c.id == topic_id).where(
+        topic.c.hidden.is_(False))
     return await conn.fetchrow(stmt)
 
 
@@ -59,34 +98,269 @@ async def update_topic(conn, topic_id, name):
     await asyncio.shield(conn.execute(stmt))
 
 
+async def hide_topic(conn, topic_id):
+    """Hide topic with nested topics, return ids of the hidden topics"""
+    tree = topic_subtree(topic_id)
+    stmt = topic.update().where(
+        topic.c.id.in_(select([tree.c.id]))
+    ).values(hidden=True).returning(topic.c.id)
+    result = await asyncio.shield(conn.fetch(stmt))
+    return [row['id'] for row in result]
+
+
+async def get_hidden_topic_ids(conn):
+    """Ids of hidden topics whose parent is not hidden, each of them is
+    the root of a subtree left to be deleted
+    """
+    parent = topic.alias('parent')
+    stmt = select([topic.c.id]).select_from(
+        topic.outerjoin(parent, parent.c.id == topic.c.parent)
+    ).where(and_(
+        topic.c.hidden.is_(True),
+        func.coalesce(parent.c.hidden, False).is_(False),
+    )).order_by(topic.c.id)
+    result = await conn.fetch(stmt)
+    return [row['id'] for row in result]
+
+
+async def get_thread_ids_by_topic_ids(conn, topic_ids, limit=None):
+    """Ids of up to `limit` oldest threads of the given topics, all of
+    them without limit
+    """
+    stmt = select([thread.c.id]).where(
+        thread.c.topic.in_(topic_ids)).order_by(thread.c.id).limit(limit)
+    result = await conn.fetch(stmt)
+    return [row['id'] for row in result]
+
+
+async def delete_messages_batch(conn, thread_id, limit, table=message):
+    """Delete up to `limit` newest messages of the thread, replies go
+    before the messages they refer to. Only the (thread, id) index range
+    of one thread is read, whatever the size of the topic.
+    """
+    batch = select([table.c.id]).where(
+        table.c.thread == thread_id
+    ).order_by(table.c.id.desc()).limit(limit)
+    # thread is given too, so partitioned table is not scanned whole
+    stmt = table.delete().where(
+        and_(table.c.thread == thread_id, table.c.id.in_(batch))
+    ).returning(table.c.id)
+    result = await asyncio.shield(conn.fetch(stmt))
+    return [row['id'] for row in result]
+
+
+async def delete_archived_messages_batch(conn, thread_id, limit):
+    return await delete_messages_batch(
+        conn, thread_id, limit, table=message_archive)
+
+
+async def delete_threads(conn, thread_ids):
+    """Delete threads by ids, they must have no messages left"""
+    stmt = thread.delete().where(
+        thread.c.id.in_(thread_ids)).returning(thread.c.id)
+    result = await asyncio.shield(conn.fetch(stmt))
+    return [row['id'] for row in result]
+
+
 async def delete_topic(conn, topic_id):
-    stmt = topic.delete().where(topic.c.id == topic_id)
-    await asyncio.shield(conn.execute(stmt))
+    """Delete topic with nested topics, they must have no threads left"""
+    tree = topic_subtree(topic_id)
+    stmt = topic.delete().where(
+        topic.c.id.in_(select([tree.c.id]))).returning(topic.c.id)
+    result = await asyncio.shield(conn.fetch(stmt))
+    return len(result)
 
 
 async def get_threads_by_topic_id(conn, topic_id):
-    stmt = thread.select().where(thread.c.topic == topic_id)
+    stmt = select([thread]).select_from(thread.join(topic)).where(
+        thread.c.topic == topic_id).where(
+        topic.c.hidden.is_(False))
     return await conn.fetch(stmt)
 
 
+async def get_latest_thread_ids(conn, limit):
+    stmt = select([thread.c.id]).order_by(thread.c.id.desc()).limit(limit)
+    result = await conn.fetch(stmt)
+    return [row['id'] for row in result]
+
+
+# counters are changed by delta in the transaction adding the content,
+# row of the topic is created by the first thread
+UPDATE_TOPIC_STATS = """
+    INSERT INTO topic_stats (topic, threads, messages)
+    SELECT thread.topic, $2::integer, $3::integer
+    FROM thread WHERE thread.id = $1
+    ON CONFLICT (topic) DO UPDATE
+    SET threads = topic_stats.threads + EXCLUDED.threads,
+        messages = topic_stats.messages + EXCLUDED.messages
+"""
+
+
+# hidden topic gets no new threads, its content is being deleted,
+# missing topic still fails on the foreign key
+CREATE_THREAD = """
+    INSERT INTO thread (title, topic, created_at)
+    SELECT $1::varchar, $2::integer, $3::timestamp
+    WHERE NOT EXISTS (
+        SELECT 1 FROM topic WHERE topic.id = $2 AND topic.hidden)
+    RETURNING id
+"""
+
+
 async def create_thread(conn, title, topic_id):
+    """Add thread, return None if the topic is hidden"""
     now = datetime.now()
-    stmt = thread.insert().values(
-        title=title, topic=topic_id, created_at=now
-    ).returning(thread.c.id)
-    return await asyncio.shield(conn.fetchrow(stmt))
+
+    async def insert():
+        async with conn.transaction():
+            row = await conn.fetchrow(CREATE_THREAD, title, topic_id, now)
+            if row is not None:
+                await conn.execute(UPDATE_TOPIC_STATS, row['id'], 1, 0)
+        return row
+    return await asyncio.shield(insert())
+
+
+def thread_messages(condition, columns=None):
+    """Messages from both hot and archive tables matching the condition
+    on thread, it is applied to each table to keep partition pruning.
+    Only given `columns` are selected if any.
+    """
+    def select_from(table):
+        if columns is None:
+            return select([table])
+        return select([table.c[name] for name in columns])
+
+    return union_all(
+        select_from(message).where(condition(message.c.thread)),
+        select_from(message_archive).where(
+            condition(message_archive.c.thread)),
+    ).alias('messages')
+
+
+def with_topic(messages):
+    """Messages joined to thread and topic, to skip hidden topics"""
+    return messages.join(
+        thread, thread.c.id == messages.c.thread
+    ).join(topic, topic.c.id == thread.c.topic)
 
 
 async def get_messages_by_thread_id(conn, thread_id):
-    stmt = message.select().where(message.c.thread == thread_id)
+    """Messages of thread, none if its topic is hidden"""
+    messages = thread_messages(lambda column: column == thread_id)
+    stmt = select([messages]).select_from(with_topic(messages)).where(
+        topic.c.hidden.is_(False)).order_by(messages.c.id)
     return await conn.fetch(stmt)
 
 
+async def get_messages_by_thread_ids(conn, thread_ids, per_thread):
+    """First `per_thread` messages of every thread in one query,
+    threads of hidden topics are skipped
+    """
+    ids = bindparam('thread_ids', thread_ids, ARRAY(Integer))
+    messages = thread_messages(lambda column: column == any_(ids))
+    position = func.row_number().over(
+        partition_by=messages.c.thread, order_by=messages.c.id)
+    ranked = select([messages, position.label('position')]).select_from(
+        with_topic(messages)).where(topic.c.hidden.is_(False)).alias('ranked')
+    stmt = select(
+        [ranked.c[column.name] for column in message.columns]
+    ).where(
+        ranked.c.position <= per_thread
+    ).order_by(ranked.c.thread, ranked.c.id)
+    return await conn.fetch(stmt)
+
+
+CREATE_MESSAGE = """
+    INSERT INTO message
+        (content, thread, starter, parent, created_at, updated_at)
+    SELECT $1::text, $2::integer, $3::boolean, $4::integer,
+        $5::timestamp, $5::timestamp
+    WHERE NOT EXISTS (
+        SELECT 1 FROM thread JOIN topic ON topic.id = thread.topic
+        WHERE thread.id = $2 AND topic.hidden)
+    RETURNING id
+"""
+
+
+# parent is not a foreign key, it may be in the archive already
+PARENT_EXISTS = """
+    SELECT EXISTS (SELECT 1 FROM message WHERE thread = $1 AND id = $2)
+        OR EXISTS (SELECT 1 FROM message_archive
+                   WHERE thread = $1 AND id = $2)
+"""
+
+
 async def create_message(conn, content, thread_id,
                          starter=False, parent=None):
+    """Add message, return None if the topic of thread is hidden.
+    Parent has to be a message of the same thread.
+    """
     now = datetime.now()
-    stmt = message.insert().values(
-        content=content, thread=thread_id,
-        starter=starter, parent=parent,
-        created_at=now, updated_at=now)
-    await asyncio.shield(conn.execute(stmt))
+
+    async def insert():
+        async with conn.transaction():
+            if parent is not None and not await conn.fetchval(
+                    PARENT_EXISTS, thread_id, parent):
+                raise ForeignKeyViolationError(
+                    'parent message {} is not in thread {}'.format(
+                        parent, thread_id))
+            row = await conn.fetchrow(
+                CREATE_MESSAGE, content, thread_id, starter, parent, now)
+            if row is not None:
+                await conn.execute(UPDATE_TOPIC_STATS, thread_id, 0, 1)
+        return row
+    return await asyncio.shield(insert())
+
+
+# markers of threads deleted in the meantime are skipped,
+# marker never moves back to an earlier message
+UPSERT_READ_MARKERS = """
+    INSERT INTO read_marker ("user", thread, message)
+    SELECT marker.user_id, marker.thread_id, marker.message_id
+    FROM unnest($1::integer[], $2::integer[], $3::integer[])
+        AS marker (user_id, thread_id, message_id)
+    WHERE EXISTS (SELECT 1 FROM thread WHERE thread.id = marker.thread_id)
+    ON CONFLICT ("user", thread) DO UPDATE
+    SET message = GREATEST(read_marker.message, EXCLUDED.message)
+"""
+
+
+async def upsert_read_markers(conn, user_ids, thread_ids, message_ids):
+    await asyncio.shield(conn.execute(
+        UPSERT_READ_MARKERS, user_ids, thread_ids, message_ids))
+
+
+async def get_unread_counts(conn, user_id, topic_id):
+    """Number of messages after read marker for every thread of topic,
+    archived messages included
+    """
+    topic_threads = select([thread.c.id]).where(thread.c.topic == topic_id)
+    messages = thread_messages(lambda column: column.in_(topic_threads),
+                               columns=('id', 'thread'))
+    markers = and_(read_marker.c.thread == thread.c.id,
+                   read_marker.c.user == user_id)
+    unread = and_(messages.c.thread == thread.c.id,
+                  messages.c.id > func.coalesce(read_marker.c.message, 0))
+    stmt = select([
+        thread.c.id.label('thread'),
+        func.count(messages.c.id).label('unread'),
+    ]).select_from(
+        thread.outerjoin(read_marker, markers).outerjoin(messages, unread)
+    ).where(
+        thread.c.topic == topic_id
+    ).group_by(thread.c.id).order_by(thread.c.id)
+    return await conn.fetch(stmt)
+
+
+async def get_stats(conn):
+    """Counters of every visible topic, no thread or message is read"""
+    stmt = select([
+        topic.c.id.label('topic'),
+        func.coalesce(topic_stats.c.threads, 0).label('threads'),
+        func.coalesce(topic_stats.c.messages, 0).label('messages'),
+    ]).select_from(
+        topic.outerjoin(topic_stats)
+    ).where(
+        topic.c.hidden.is_(False)
+    ).order_by(topic.c.id)
+    return await conn.fetch(stmt)
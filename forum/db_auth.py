@@ -1,18 +1,24 @@
 from aiohttp_security.abc import AbstractAuthorizationPolicy
 
-from forum import db
+from forum.db_context import current_db_context
 
 
 class DBAuthorizationPolicy(AbstractAuthorizationPolicy):
 
-    def __init__(self, db_pool):
+    def __init__(self, db_pool, db):
         self.db_pool = db_pool
+        self.db = db
 
     async def authorized_userid(self, identity):
-        async with self.db_pool.acquire() as conn:
-            user = await db.get_user_by_name(conn, identity)
-            if user:
-                return identity
+        # inside a request the user row is kept for permission checks
+        context = current_db_context.get()
+        if context is not None:
+            user = await context.get_user(identity)
+        else:
+            async with self.db_pool.acquire() as conn:
+                user = await self.db.get_user_by_name(conn, identity)
+        if user:
+            return identity
 
         return None
 
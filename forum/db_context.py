@@ -0,0 +1,67 @@
+from collections import Counter
+import contextvars
+
+from aiohttp import web
+
+# database context of the request being handled, set by the middleware
+current_db_context = contextvars.ContextVar('current_db_context',
+                                            default=None)
+
+
+class DBContext:
+    """Pool connection and user rows shared by everything handling one
+    request: security policy, permission checks and the view itself.
+
+    Connection is taken from pool on first use and held until the
+    response is ready, so it must not be passed to background tasks.
+    """
+
+    def __init__(self, db, db_pool, stats):
+        self.db = db
+        self.db_pool = db_pool
+        self.stats = stats
+        self.conn = None
+        self.users = {}
+
+    async def connection(self):
+        if self.conn is None:
+            self.conn = await self.db_pool.acquire()
+            self.stats['acquired'] += 1
+        return self.conn
+
+    async def get_user(self, username):
+        """User row with its role, fetched once per request"""
+        if username not in self.users:
+            conn = await self.connection()
+            self.users[username] = await self.db.get_user_by_name(
+                conn, username)
+        return self.users[username]
+
+    async def close(self):
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            await self.db_pool.release(conn)
+
+
+def db_context_middleware(stats):
+
+    @web.middleware
+    async def middleware(request, handler):
+        context = DBContext(request.app['db'], request.app['db_pool'], stats)
+        request['db_context'] = context
+        token = current_db_context.set(context)
+        stats['requests'] += 1
+        try:
+            return await handler(request)
+        finally:
+            current_db_context.reset(token)
+            await context.close()
+
+    return middleware
+
+
+def setup_db_context(app):
+    """Install the middleware, it has to wrap all others using db"""
+    stats = Counter(requests=0, acquired=0)
+    app['metrics']['db_context'] = lambda: dict(stats)
+    app.middlewares.append(db_context_middleware(stats))
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_DELAY = 0.1
+# finished job is reported at /topics/{id}/deletion this long, seconds
+DEFAULT_KEEP_FINISHED = 3600
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 1.0
+
+
+class TopicDeletion:
+    """Background removal of a topic with all its content.
+
+    The topic is hidden before the job starts, then messages, threads
+    and nested topics are deleted in small batches, each one in its own
+    short transaction with a pause in between, so the `thread` and
+    `message` tables are never locked for long.
+    """
+
+    def __init__(self, db, db_pool, thread_cache, topic_id, topic_ids,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 batch_delay=DEFAULT_BATCH_DELAY):
+        self.db = db
+        self.db_pool = db_pool
+        self.thread_cache = thread_cache
+        self.topic_id = topic_id
+        self.topic_ids = topic_ids
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.status = 'pending'
+        self.deleted = {'messages': 0, 'threads': 0, 'topics': 0}
+        self.task = None
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        return {
+            'topic': self.topic_id,
+            'status': self.status,
+            'deleted': dict(self.deleted),
+        }
+
+    async def delete_thread_messages(self, thread_id, delete_batch):
+        while True:
+            async with self.db_pool.acquire() as conn:
+                deleted_ids = await delete_batch(
+                    conn, thread_id, self.batch_size)
+            self.deleted['messages'] += len(deleted_ids)
+            if len(deleted_ids) < self.batch_size:
+                return
+            await asyncio.sleep(self.batch_delay)
+
+    async def delete_threads(self):
+        """Delete threads a batch at a time, each after its messages"""
+        while True:
+            async with self.db_pool.acquire() as conn:
+                thread_ids = await self.db.get_thread_ids_by_topic_ids(
+                    conn, self.topic_ids, self.batch_size)
+            if not thread_ids:
+                return
+            for thread_id in thread_ids:
+                await self.delete_thread_messages(
+                    thread_id, self.db.delete_messages_batch)
+                await self.delete_thread_messages(
+                    thread_id, self.db.delete_archived_messages_batch)
+            async with self.db_pool.acquire() as conn:
+                deleted_ids = await self.db.delete_threads(conn, thread_ids)
+            for thread_id in deleted_ids:
+                self.thread_cache.invalidate(thread_id)
+            self.deleted['threads'] += len(deleted_ids)
+            await asyncio.sleep(self.batch_delay)
+
+    async def run(self):
+        self.status = 'running'
+        try:
+            # hidden topic gets no new content, but requests already in
+            # flight may still add some, then the whole pass is repeated
+            for attempt in range(MAX_ATTEMPTS):
+                try:
+                    await self.delete_threads()
+                    async with self.db_pool.acquire() as conn:
+                        count = await self.db.delete_topic(conn, self.topic_id)
+                except asyncpg.exceptions.ForeignKeyViolationError:
+                    await asyncio.sleep(self.batch_delay)
+                    continue
+                self.deleted['topics'] += count
+                self.status = 'done'
+                return
+            self.status = 'failed'
+        except asyncio.CancelledError:
+            self.status = 'failed'
+            raise
+        except Exception as exc:
+            log.exception(exc)
+            self.status = 'failed'
+
+
+def start_topic_deletion(app, topic_id, topic_ids):
+    """Start the deletion job for hidden topic or return the running one"""
+    jobs = app['topic_deletions']
+    job = jobs.get(topic_id)
+    if job and not job.finished:
+        return job
+
+    config = app['config'].get('deletion', {})
+    job = TopicDeletion(
+        app['db'], app['db_pool'], app['thread_cache'], topic_id, topic_ids,
+        batch_size=config.get('BATCH_SIZE', DEFAULT_BATCH_SIZE),
+        batch_delay=config.get('BATCH_DELAY', DEFAULT_BATCH_DELAY),
+    )
+    job.task = asyncio.ensure_future(job.run())
+    jobs[topic_id] = job
+
+    def forget_job():
+        if jobs.get(topic_id) is job:
+            del jobs[topic_id]
+
+    keep = config.get('KEEP_FINISHED', DEFAULT_KEEP_FINISHED)
+    job.task.add_done_callback(
+        lambda task: asyncio.get_event_loop().call_later(keep, forget_job))
+    return job
+
+
+async def resume_topic_deletions(app):
+    """Restart jobs for topics left hidden by a stopped server"""
+    while True:
+        try:
+            async with app['db_pool'].acquire() as conn:
+                for topic_id in await app['db'].get_hidden_topic_ids(conn):
+                    # gives ids of the subtree, hiding it again is harmless
+                    topic_ids = await app['db'].hide_topic(conn, topic_id)
+                    start_topic_deletion(app, topic_id, topic_ids)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception('Topic deletions are not resumed, retrying')
+            await asyncio.sleep(RETRY_DELAY)
+        else:
+            return
+
+
+async def cancel_topic_deletions(app):
+    """Stop running jobs, hidden topics are resumed on next startup"""
+    app['deletion_resume'].cancel()
+    tasks = [job.task for job in app['topic_deletions'].values()
+             if not job.finished]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(app['deletion_resume'], *tasks,
+                         return_exceptions=True)
+
+
+def setup_deletion(app):
+    app['topic_deletions'] = {}
+
+    async def start_resume(app):
+        # in background, readiness does not wait for it
+        app['deletion_resume'] = asyncio.ensure_future(
+            resume_topic_deletions(app))
+
+    app.on_startup.append(start_resume)
+    app.on_cleanup.append(cancel_topic_deletions)
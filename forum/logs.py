@@ -0,0 +1,84 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+
+from aiohttp.abc import AbstractAccessLogger
+
+DEFAULT_LEVEL = 'INFO'
+DEFAULT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+class LogFormatter(logging.Formatter):
+    """Plain text for application records, JSON for access records"""
+
+    def format(self, record):
+        access = getattr(record, 'access', None)
+        if access is None:
+            return super().format(record)
+        return json.dumps(dict(access, time=self.formatTime(record)))
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler which leaves formatting to the listener thread"""
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonAccessLogger(AbstractAccessLogger):
+    """Structured access log with per route sampling.
+
+    `sampling` maps canonical route path to the fraction of requests
+    logged, server errors are always logged.
+    """
+    sampling = {}
+
+    def log(self, request, response, time):
+        route = request.match_info.route.resource
+        path = route.canonical if route else request.path
+        rate = self.sampling.get(path)
+        if rate is not None and response.status < 500:
+            if random.random() >= rate:
+                return
+
+        self.logger.info('%s %s', request.method, request.path, extra={
+            'access': {
+                'method': request.method,
+                'path': request.path,
+                'route': path,
+                'status': response.status,
+                'size': response.body_length,
+                'duration': round(time, 6),
+                'remote': request.remote,
+                'sampling': rate,
+            }
+        })
+
+
+def setup_logging(config):
+    """Route all records through a queue to a listener thread,
+    nothing is formatted or written on the event loop.
+    """
+    config = config.get('logging', {})
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(LogFormatter(config.get('FORMAT', DEFAULT_FORMAT)))
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, handler)
+
+    root = logging.getLogger()
+    root.handlers = [NonBlockingQueueHandler(log_queue)]
+    root.setLevel(config.get('LEVEL', DEFAULT_LEVEL))
+    for name, level in config.get('levels', {}).items():
+        logging.getLogger(name).setLevel(level)
+
+    JsonAccessLogger.sampling = config.get('sampling', {})
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
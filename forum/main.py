@@ -1,17 +1,24 @@
 import logging
-import os
 
 from aiohttp import web
 from aiohttp.web import normalize_path_middleware
 from aiohttp_security import setup as setup_security, SessionIdentityPolicy
 from aiohttp_session import SimpleCookieStorage, session_middleware
-from aiohttp_swagger import *
-import sentry_sdk
 
-from forum.db import init_db
+from forum.backends import get_backend
+from forum.cache import setup_cache
 from forum.db_auth import DBAuthorizationPolicy
+from forum.db_context import setup_db_context
+from forum.deletion import setup_deletion
+from forum.logs import setup_logging, JsonAccessLogger
+from forum.markers import setup_read_markers
+from forum.profiling import setup_profiling
 from forum.routes import setup_routes
 from forum.settings import load_config, BASE_DIR
+from forum.swagger import setup_swagger
+from forum.tasks import setup_tasks
+from forum.tracing import setup_tracing
+from forum.warmup import setup_warmup
 
 
 log = logging.getLogger(__name__)
@@ -27,28 +34,39 @@ async def init_app(config):
     app = web.Application(middlewares=middlewares)
 
     app['config'] = config
+    app['metrics'] = {}
     setup_routes(app)
 
-    swagger_filepath = os.path.join(BASE_DIR, 'docs', 'swagger.yaml')
-    setup_swagger(app, swagger_from_file=swagger_filepath)
+    setup_swagger(app, BASE_DIR / 'docs' / 'swagger.yaml')
 
-    db_pool = await init_db(app)
+    setup_tasks(app)
+    setup_tracing(app)
+    app['db'] = get_backend(config)
+    db_pool = await app['db'].init_db(app)
+    setup_db_context(app)
+    setup_cache(app)
+    setup_deletion(app)
+    setup_read_markers(app)
+    setup_profiling(app)
+    setup_warmup(app)
 
     setup_security(app, SessionIdentityPolicy(),
-                   DBAuthorizationPolicy(db_pool))
+                   DBAuthorizationPolicy(db_pool, app['db']))
 
-    log.debug(app['config'])
+    log.debug('Config sections: %s', ', '.join(config))
 
     return app
 
 
 def main(configpath):
     config = load_config(configpath)
-    logging.basicConfig(level=logging.DEBUG)
+    setup_logging(config)
+    # imported only here, the app itself and tests do not need it
+    import sentry_sdk
     # SENTRY_KEY has a fake value in config
     sentry_sdk.init(config['sentry']['SENTRY_KEY'])
     app = init_app(config)
-    web.run_app(app)
+    web.run_app(app, access_log_class=JsonAccessLogger)
 
 
 # if __name__ == '__main__':
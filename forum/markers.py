@@ -0,0 +1,126 @@
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_MAX_PENDING = 1000
+
+
+class ReadMarkers:
+    """Buffer of per user read markers written to db in batches.
+
+    Page views only update the buffer, it is flushed with a single
+    upsert every `flush_interval` seconds or as soon as `max_pending`
+    markers are collected. A request may write the markers of its user
+    at once on its own connection with `flush_user`.
+    """
+
+    def __init__(self, db, db_pool, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_pending=DEFAULT_MAX_PENDING):
+        self.db = db
+        self.db_pool = db_pool
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = {}
+        # batch taken by flush while it is being written
+        self.writing = {}
+        self.flush_lock = asyncio.Lock()
+        self.flush_needed = None
+        self.flusher = None
+
+    def mark(self, user_id, thread_id, message_id):
+        key = (user_id, thread_id)
+        if self.pending.get(key, 0) >= message_id:
+            return
+        self.pending[key] = message_id
+        if len(self.pending) >= self.max_pending and self.flush_needed:
+            self.flush_needed.set()
+
+    async def write(self, conn, markers):
+        await self.db.upsert_read_markers(
+            conn,
+            [user_id for user_id, _ in markers],
+            [thread_id for _, thread_id in markers],
+            list(markers.values()))
+
+    def merge(self, markers):
+        # markers are merged back to be written with the next batch
+        for (user_id, thread_id), message_id in markers.items():
+            self.mark(user_id, thread_id, message_id)
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            self.writing, self.pending = self.pending, {}
+            try:
+                async with self.db_pool.acquire() as conn:
+                    await self.write(conn, self.writing)
+            except Exception:
+                self.merge(self.writing)
+                raise
+            finally:
+                self.writing = {}
+
+    async def flush_user(self, conn, user_id):
+        """Write markers of one user on the connection the caller holds,
+        those of a batch being flushed right now are written too.
+        Errors are only logged, the markers stay for the next flush.
+        """
+        markers = {}
+        for buffer in (self.writing, self.pending):
+            for key, message_id in buffer.items():
+                if key[0] == user_id:
+                    markers[key] = max(markers.get(key, 0), message_id)
+        if not markers:
+            return
+        for key in markers:
+            self.pending.pop(key, None)
+        try:
+            await self.write(conn, markers)
+        except Exception:
+            log.exception('Read markers of user %s are not saved', user_id)
+            self.merge(markers)
+
+    async def flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_needed.wait(),
+                                       self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_needed.clear()
+            try:
+                await self.flush()
+            except Exception:
+                log.exception('Read markers are not saved')
+
+    async def start(self):
+        self.flush_needed = asyncio.Event()
+        self.flusher = asyncio.ensure_future(self.flush_periodically())
+
+    async def stop(self):
+        self.flusher.cancel()
+        await asyncio.gather(self.flusher, return_exceptions=True)
+        await self.flush()
+
+
+def setup_read_markers(app):
+    config = app['config'].get('read_markers', {})
+    markers = ReadMarkers(
+        app['db'],
+        app['db_pool'],
+        flush_interval=config.get('FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+        max_pending=config.get('MAX_PENDING', DEFAULT_MAX_PENDING),
+    )
+    app['read_markers'] = markers
+
+    async def start_read_markers(app):
+        await markers.start()
+
+    async def stop_read_markers(app):
+        await markers.stop()
+
+    app.on_startup.append(start_read_markers)
+    app.on_cleanup.append(stop_read_markers)
@@ -0,0 +1,593 @@
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+import heapq
+from operator import itemgetter
+
+from asyncpg import exceptions
+from sqlalchemy import Boolean, DateTime
+
+from forum.db import DEFAULT_POOL_MIN_SIZE, DEFAULT_POOL_MAX_SIZE
+from forum.models import metadata, message, message_archive
+from forum.sample_data import sample_data
+
+by_id = itemgetter('id')
+
+
+class MemoryTable:
+    """Rows of a table by primary key, with a lookup index on every
+    unique and foreign key column.
+    """
+
+    def __init__(self, table):
+        self.name = table.name
+        self.columns = list(table.columns)
+        self.key_columns = [column.name for column in table.primary_key]
+        self.rows = {}
+        self.last_id = 0
+        self.unique = {column.name: {}
+                       for column in self.columns if column.unique}
+        self.foreign_keys = {
+            column.name: (foreign_key.column.table.name, foreign_key.ondelete)
+            for column in self.columns
+            for foreign_key in column.foreign_keys
+        }
+        self.indexes = {name: {} for name in self.foreign_keys}
+
+    def key(self, row):
+        if len(self.key_columns) == 1:
+            return row[self.key_columns[0]]
+        return tuple(row[name] for name in self.key_columns)
+
+    def find(self, column, value):
+        """Row by value of unique column or None"""
+        key = self.unique[column].get(value)
+        return None if key is None else self.rows[key]
+
+    def lookup(self, column, value):
+        """Rows referring to `value` through foreign key column"""
+        return list(self.indexes[column].get(value, {}).values())
+
+    def add(self, row):
+        key = self.key(row)
+        self.rows[key] = row
+        for name, values in self.unique.items():
+            values[row[name]] = key
+        for name, index in self.indexes.items():
+            if row[name] is not None:
+                index.setdefault(row[name], {})[key] = row
+
+    def remove(self, key):
+        row = self.rows.pop(key)
+        for name, values in self.unique.items():
+            del values[row[name]]
+        for name, index in self.indexes.items():
+            if row[name] is not None:
+                rows = index[row[name]]
+                del rows[key]
+                if not rows:
+                    del index[row[name]]
+        return row
+
+
+def coerce(column, value):
+    """Cast literal to the column type the way PostgreSQL does"""
+    if isinstance(value, str) and isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    if value is not None and isinstance(column.type, Boolean):
+        return bool(value)
+    return value
+
+
+class MemoryStore:
+    """Tables of forum.models kept in process memory.
+
+    Not null, length, unique and foreign key constraints of the models
+    are checked before anything is changed, violations raise the same
+    asyncpg exceptions as PostgreSQL does.
+    """
+
+    def __init__(self):
+        self.tables = {table.name: MemoryTable(table)
+                       for table in metadata.sorted_tables}
+        # foreign keys of other tables referring to the table
+        self.references = defaultdict(list)
+        for table in self.tables.values():
+            for column, (target, ondelete) in table.foreign_keys.items():
+                self.references[target].append((table, column, ondelete))
+
+    def check(self, table, row, key):
+        for column in table.columns:
+            value = row[column.name]
+            if value is None:
+                if not column.nullable:
+                    raise exceptions.NotNullViolationError(
+                        'null value in column "{}" violates not-null '
+                        'constraint'.format(column.name))
+                continue
+            length = getattr(column.type, 'length', None)
+            if length is not None and len(value) > length:
+                raise exceptions.StringDataRightTruncationError(
+                    'value too long for type character varying({})'.format(
+                        length))
+            if column.name in table.unique:
+                existing = table.unique[column.name].get(value, key)
+                if existing != key:
+                    raise exceptions.UniqueViolationError(
+                        'duplicate key value violates unique constraint '
+                        'on "{}"'.format(table.name))
+            if column.name in table.foreign_keys:
+                target, _ = table.foreign_keys[column.name]
+                if value not in self.tables[target].rows:
+                    raise exceptions.ForeignKeyViolationError(
+                        'insert or update on table "{}" violates foreign '
+                        'key constraint on "{}"'.format(
+                            table.name, column.name))
+
+    def insert(self, table, values):
+        row = {}
+        for column in table.columns:
+            if column.name in values:
+                row[column.name] = values[column.name]
+            elif column.default is not None:
+                row[column.name] = column.default.arg
+            else:
+                row[column.name] = None
+        if table.key_columns == ['id'] and row['id'] is None:
+            table.last_id += 1
+            row['id'] = table.last_id
+
+        key = table.key(row)
+        if key in table.rows:
+            raise exceptions.UniqueViolationError(
+                'duplicate key value violates unique constraint '
+                'on "{}"'.format(table.name))
+        self.check(table, row, key)
+        table.add(row)
+        return row
+
+    def update(self, table, key, values):
+        old = table.rows[key]
+        row = dict(old, **values)
+        self.check(table, row, key)
+        table.remove(key)
+        table.add(row)
+        return old
+
+    def collect_deleted(self, table, keys, deleted):
+        """Add keys of rows removed along with `keys` to `deleted`"""
+        keys = [key for key in keys
+                if key in table.rows and key not in deleted[table]]
+        deleted[table].update(keys)
+        for referring, column, ondelete in self.references[table.name]:
+            found = [referring.key(row) for key in keys
+                     for row in referring.lookup(column, key)]
+            found = [key for key in found if key not in deleted[referring]]
+            if not found:
+                continue
+            if ondelete != 'CASCADE':
+                raise exceptions.ForeignKeyViolationError(
+                    'update or delete on table "{}" violates foreign key '
+                    'constraint on table "{}"'.format(
+                        table.name, referring.name))
+            self.collect_deleted(referring, found, deleted)
+
+    def delete(self, table, keys):
+        """Delete rows by keys, return removed (table, row) pairs"""
+        deleted = defaultdict(set)
+        self.collect_deleted(table, keys, deleted)
+        return [(target, target.remove(key))
+                for target, target_keys in deleted.items()
+                for key in target_keys]
+
+    def load(self, data):
+        """Insert rows given as (table, rows) pairs like sample data,
+        topic stats are counted from the loaded rows.
+        """
+        for table, rows in data:
+            target = self.tables[table.name]
+            for row in rows:
+                self.insert(target, {
+                    column.name: coerce(column, row[column.name])
+                    for column in table.columns if column.name in row})
+        self.count_topic_stats()
+
+    def count_topic_stats(self):
+        threads = self.tables['thread']
+        stats = self.tables['topic_stats']
+        for topic_id in list(stats.rows):
+            stats.remove(topic_id)
+        for topic_id in self.tables['topic'].rows:
+            thread_ids = [row['id']
+                          for row in threads.lookup('topic', topic_id)]
+            if not thread_ids:
+                continue
+            messages = sum(
+                len(self.tables[name].lookup('thread', thread_id))
+                for name in ('message', 'message_archive')
+                for thread_id in thread_ids)
+            self.insert(stats, {'topic': topic_id,
+                                'threads': len(thread_ids),
+                                'messages': messages})
+
+
+class MemoryConnection:
+    """Connection to the store, changes made inside `transaction()`
+    are undone when it fails. There is no isolation between concurrent
+    transactions, every call is atomic as it never awaits.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.journal = None
+
+    def record(self, undo):
+        if self.journal is not None:
+            self.journal.append(undo)
+
+    @contextmanager
+    def statement(self):
+        """Undo changes made in the block if it raises"""
+        outermost = self.journal is None
+        if outermost:
+            self.journal = []
+        savepoint = len(self.journal)
+        try:
+            yield
+        except BaseException:
+            while len(self.journal) > savepoint:
+                self.journal.pop()()
+            raise
+        finally:
+            if outermost:
+                self.journal = None
+
+    def transaction(self):
+        return MemoryTransaction(self)
+
+    def insert(self, name, values):
+        table = self.store.tables[name]
+        row = self.store.insert(table, values)
+        self.record(lambda: table.remove(table.key(row)))
+        return dict(row)
+
+    def update(self, name, key, values):
+        table = self.store.tables[name]
+        old = self.store.update(table, key, values)
+
+        def undo():
+            table.remove(key)
+            table.add(old)
+        self.record(undo)
+
+    def delete(self, name, keys):
+        """Delete rows by keys, return removed rows of the table"""
+        table = self.store.tables[name]
+        removed = self.store.delete(table, keys)
+
+        def undo():
+            for target, row in removed:
+                target.add(row)
+        self.record(undo)
+        return [dict(row) for target, row in removed if target is table]
+
+
+class MemoryTransaction:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.statement = None
+
+    async def __aenter__(self):
+        self.statement = self.conn.statement()
+        self.statement.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.statement.__exit__(exc_type, exc, tb)
+
+
+class MemoryAcquireContext:
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+
+    def __await__(self):
+        return self.pool.connect().__await__()
+
+    async def __aenter__(self):
+        self.conn = await self.pool.connect()
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.pool.release(self.conn)
+
+
+class MemoryPool:
+    """Pool with the interface of asyncpg one, acquire waits when all
+    `max_size` connections are taken.
+    """
+
+    def __init__(self, store, max_size=DEFAULT_POOL_MAX_SIZE):
+        self.store = store
+        self.semaphore = asyncio.Semaphore(max_size)
+
+    def acquire(self):
+        return MemoryAcquireContext(self)
+
+    async def connect(self):
+        await self.semaphore.acquire()
+        return MemoryConnection(self.store)
+
+    async def release(self, conn):
+        conn.journal = None
+        self.semaphore.release()
+
+    async def close(self):
+        pass
+
+
+async def init_db(app):
+    """Empty store or the one with sample data if SAMPLE_DATA is set"""
+    config = app['config']['database']
+    store = MemoryStore()
+    if config.get('SAMPLE_DATA', False):
+        store.load(sample_data())
+    pool = MemoryPool(
+        store, config.get('POOL_MAX_SIZE', DEFAULT_POOL_MAX_SIZE))
+    app['db_pool'] = pool
+    app['db_min_size'] = config.get('POOL_MIN_SIZE', DEFAULT_POOL_MIN_SIZE)
+    return pool
+
+
+async def get_user_by_name(conn, username):
+    row = conn.store.tables['user'].find('username', username)
+    return None if row is None else dict(row)
+
+
+async def get_users(conn):
+    rows = conn.store.tables['user'].rows.values()
+    return [dict(row) for row in sorted(rows, key=by_id)]
+
+
+async def create_user(conn, username, password_hash):
+    conn.insert('user', {'username': username,
+                         'password_hash': password_hash})
+
+
+# hidden flag is internal, topics are always returned without it
+TOPIC_COLUMNS = ('id', 'name', 'parent')
+
+
+def topic_row(row):
+    return {name: row[name] for name in TOPIC_COLUMNS}
+
+
+def topic_subtree(store, topic_id):
+    """Ids of the topic and all its nested topics"""
+    topics = store.tables['topic']
+    if topic_id not in topics.rows:
+        return []
+    tree = [topic_id]
+    for parent in tree:
+        tree.extend(row['id'] for row in topics.lookup('parent', parent))
+    return tree
+
+
+async def get_topics(conn):
+    rows = conn.store.tables['topic'].rows.values()
+    return [topic_row(row) for row in sorted(rows, key=by_id)
+            if not row['hidden']]
+
+
+async def get_topic_by_id(conn, topic_id):
+    row = conn.store.tables['topic'].rows.get(topic_id)
+    if row is None or row['hidden']:
+        return None
+    return topic_row(row)
+
+
+async def create_topic(conn, name):
+    conn.insert('topic', {'name': name})
+
+
+async def update_topic(conn, topic_id, name):
+    if topic_id in conn.store.tables['topic'].rows:
+        conn.update('topic', topic_id, {'name': name})
+
+
+async def hide_topic(conn, topic_id):
+    """Hide topic with nested topics, return ids of the hidden topics"""
+    topic_ids = topic_subtree(conn.store, topic_id)
+    with conn.statement():
+        for hidden_id in topic_ids:
+            conn.update('topic', hidden_id, {'hidden': True})
+    return topic_ids
+
+
+async def get_hidden_topic_ids(conn):
+    """Ids of hidden topics whose parent is not hidden"""
+    topics = conn.store.tables['topic'].rows
+    return sorted(
+        row['id'] for row in topics.values()
+        if row['hidden'] and not (row['parent'] is not None and
+                                  topics[row['parent']]['hidden']))
+
+
+def topic_threads(store, topic_ids):
+    threads = store.tables['thread']
+    return [row['id'] for topic_id in topic_ids
+            for row in threads.lookup('topic', topic_id)]
+
+
+async def get_thread_ids_by_topic_ids(conn, topic_ids, limit=None):
+    """Ids of up to `limit` oldest threads of the given topics, all of
+    them without limit
+    """
+    thread_ids = topic_threads(conn.store, topic_ids)
+    if limit is None:
+        return sorted(thread_ids)
+    return heapq.nsmallest(limit, thread_ids)
+
+
+async def delete_messages_batch(conn, thread_id, limit, table=message):
+    """Delete up to `limit` newest messages of the thread"""
+    rows = conn.store.tables[table.name].lookup('thread', thread_id)
+    batch = heapq.nlargest(limit, (row['id'] for row in rows))
+    return [row['id'] for row in conn.delete(table.name, batch)]
+
+
+async def delete_archived_messages_batch(conn, thread_id, limit):
+    return await delete_messages_batch(
+        conn, thread_id, limit, table=message_archive)
+
+
+async def delete_threads(conn, thread_ids):
+    """Delete threads by ids, they must have no messages left"""
+    return [row['id'] for row in conn.delete('thread', thread_ids)]
+
+
+async def delete_topic(conn, topic_id):
+    """Delete topic with nested topics, they must have no threads left"""
+    topic_ids = topic_subtree(conn.store, topic_id)
+    return len(conn.delete('topic', topic_ids))
+
+
+async def get_threads_by_topic_id(conn, topic_id):
+    topic = conn.store.tables['topic'].rows.get(topic_id)
+    if topic is None or topic['hidden']:
+        return []
+    rows = conn.store.tables['thread'].lookup('topic', topic_id)
+    return [dict(row) for row in sorted(rows, key=by_id)]
+
+
+async def get_latest_thread_ids(conn, limit):
+    return heapq.nlargest(limit, conn.store.tables['thread'].rows)
+
+
+def update_topic_stats(conn, thread_id, threads, messages):
+    """Add deltas to counters of the topic the thread belongs to"""
+    topic_id = conn.store.tables['thread'].rows[thread_id]['topic']
+    stats = conn.store.tables['topic_stats'].rows.get(topic_id)
+    if stats is None:
+        conn.insert('topic_stats', {
+            'topic': topic_id, 'threads': threads, 'messages': messages})
+    else:
+        conn.update('topic_stats', topic_id, {
+            'threads': stats['threads'] + threads,
+            'messages': stats['messages'] + messages})
+
+
+def topic_hidden(store, topic_id):
+    topic = store.tables['topic'].rows.get(topic_id)
+    return topic is not None and topic['hidden']
+
+
+async def create_thread(conn, title, topic_id):
+    """Add thread, return None if the topic is hidden"""
+    if topic_hidden(conn.store, topic_id):
+        return None
+    with conn.statement():
+        row = conn.insert('thread', {
+            'title': title, 'topic': topic_id, 'created_at': datetime.now()})
+        update_topic_stats(conn, row['id'], 1, 0)
+    return {'id': row['id']}
+
+
+def thread_messages(store, thread_id):
+    """Messages of thread from both hot and archive tables by id,
+    none if the topic of thread is hidden
+    """
+    thread = store.tables['thread'].rows.get(thread_id)
+    if thread is None or topic_hidden(store, thread['topic']):
+        return []
+    rows = (store.tables['message'].lookup('thread', thread_id) +
+            store.tables['message_archive'].lookup('thread', thread_id))
+    return [dict(row) for row in sorted(rows, key=by_id)]
+
+
+async def get_messages_by_thread_id(conn, thread_id):
+    return thread_messages(conn.store, thread_id)
+
+
+async def get_messages_by_thread_ids(conn, thread_ids, per_thread):
+    """First `per_thread` messages of every thread"""
+    return [row for thread_id in sorted(set(thread_ids))
+            for row in thread_messages(conn.store, thread_id)[:per_thread]]
+
+
+async def create_message(conn, content, thread_id,
+                         starter=False, parent=None):
+    """Add message, return None if the topic of thread is hidden.
+    Parent has to be a message of the same thread.
+    """
+    thread = conn.store.tables['thread'].rows.get(thread_id)
+    if thread is not None and topic_hidden(conn.store, thread['topic']):
+        return None
+    if parent is not None and not any(
+            conn.store.tables[name].rows.get(parent, {}).get('thread') ==
+            thread_id for name in ('message', 'message_archive')):
+        raise exceptions.ForeignKeyViolationError(
+            'parent message {} is not in thread {}'.format(
+                parent, thread_id))
+    now = datetime.now()
+    with conn.statement():
+        row = conn.insert('message', {
+            'content': content, 'thread': thread_id,
+            'starter': starter, 'parent': parent,
+            'created_at': now, 'updated_at': now,
+        })
+        update_topic_stats(conn, thread_id, 0, 1)
+    return {'id': row['id']}
+
+
+async def upsert_read_markers(conn, user_ids, thread_ids, message_ids):
+    """Markers of deleted threads are skipped, marker never moves back"""
+    markers = conn.store.tables['read_marker']
+    threads = conn.store.tables['thread']
+    with conn.statement():
+        for user_id, thread_id, message_id in zip(
+                user_ids, thread_ids, message_ids):
+            if thread_id not in threads.rows:
+                continue
+            marker = markers.rows.get((user_id, thread_id))
+            if marker is None:
+                conn.insert('read_marker', {
+                    'user': user_id, 'thread': thread_id,
+                    'message': message_id})
+            elif message_id > marker['message']:
+                conn.update('read_marker', (user_id, thread_id),
+                            {'message': message_id})
+
+
+async def get_unread_counts(conn, user_id, topic_id):
+    """Number of messages after read marker for every thread of topic,
+    archived messages included
+    """
+    markers = conn.store.tables['read_marker']
+    tables = [conn.store.tables[name]
+              for name in ('message', 'message_archive')]
+    result = []
+    for thread_id in sorted(topic_threads(conn.store, [topic_id])):
+        marker = markers.rows.get((user_id, thread_id))
+        last_read = marker['message'] if marker else 0
+        unread = sum(1 for table in tables
+                     for row in table.lookup('thread', thread_id)
+                     if row['id'] > last_read)
+        result.append({'thread': thread_id, 'unread': unread})
+    return result
+
+
+async def get_stats(conn):
+    """Counters of every visible topic, no thread or message is read"""
+    stats = conn.store.tables['topic_stats'].rows
+    result = []
+    for row in sorted(conn.store.tables['topic'].rows.values(), key=by_id):
+        if row['hidden']:
+            continue
+        counters = stats.get(row['id'], {'threads': 0, 'messages': 0})
+        result.append({'topic': row['id'],
+                       'threads': counters['threads'],
+                       'messages': counters['messages']})
+    return result
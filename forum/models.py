@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    MetaData, Table, Column, ForeignKey,
+    MetaData, Table, Column, ForeignKey, Index,
     Integer, String, DateTime, Text, Boolean
 )
 
@@ -19,7 +19,8 @@ topic = Table(
     'topic', metadata,
     Column('id', Integer, primary_key=True, autoincrement=True),
     Column('name', String(64), nullable=False, unique=True),
-    Column('parent', Integer, ForeignKey('topic.id'))
+    Column('parent', Integer, ForeignKey('topic.id')),
+    Column('hidden', Boolean, nullable=False, default=False)
 )
 
 thread = Table(
@@ -30,13 +31,52 @@ thread = Table(
     Column('created_at', DateTime, nullable=False)
 )
 
+# db_helpers may create it hash partitioned by thread instead,
+# all queries filter messages by thread to hit a single partition.
+# parent may be moved to message_archive before its replies, so it is
+# not a foreign key, create_message checks it is a message of the thread
 message = Table(
     'message', metadata,
     Column('id', Integer, primary_key=True, autoincrement=True),
     Column('content', Text, nullable=False),
     Column('thread', Integer, ForeignKey('thread.id'), nullable=False),
-    Column('parent', Integer, ForeignKey('message.id'), nullable=True),
+    Column('parent', Integer, nullable=True),
     Column('starter', Boolean, nullable=False, default=False),
     Column('created_at', DateTime, nullable=False),
-    Column('updated_at', DateTime, nullable=False)
+    Column('updated_at', DateTime, nullable=False),
+    # messages are always read by thread in order of creation
+    Index('message_thread_id_idx', 'thread', 'id')
+)
+
+# messages of inactive threads moved out of `message` by archive job
+message_archive = Table(
+    'message_archive', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('content', Text, nullable=False),
+    Column('thread', Integer, ForeignKey('thread.id'), nullable=False),
+    Column('parent', Integer, nullable=True),
+    Column('starter', Boolean, nullable=False, default=False),
+    Column('created_at', DateTime, nullable=False),
+    Column('updated_at', DateTime, nullable=False),
+    Index('message_archive_thread_id_idx', 'thread', 'id')
+)
+
+# id of the last message user has seen in thread
+read_marker = Table(
+    'read_marker', metadata,
+    Column('user', Integer, ForeignKey('user.id', ondelete='CASCADE'),
+           primary_key=True),
+    Column('thread', Integer, ForeignKey('thread.id', ondelete='CASCADE'),
+           primary_key=True),
+    Column('message', Integer, nullable=False)
+)
+
+# thread and message counters of topic, changed in the transactions
+# which add content, removed together with the topic
+topic_stats = Table(
+    'topic_stats', metadata,
+    Column('topic', Integer, ForeignKey('topic.id', ondelete='CASCADE'),
+           primary_key=True),
+    Column('threads', Integer, nullable=False, default=0),
+    Column('messages', Integer, nullable=False, default=0)
 )
@@ -0,0 +1,223 @@
+import cProfile
+from collections import deque
+import contextvars
+import functools
+import inspect
+import itertools
+import marshal
+import pstats
+import random
+import time
+
+from aiohttp import web
+from aiohttp.web import json_response
+from aiohttp_security import authorized_userid
+
+from forum.views import BaseView
+
+DEFAULT_HEADER = 'X-Profile'
+DEFAULT_KEEP = 20
+
+# time the profiled request awaited storage backend calls, set by the
+# middleware to a one item list, other requests leave it None
+db_time = contextvars.ContextVar('db_time', default=None)
+
+# profile time is split by the module the function comes from, 'db' is
+# measured separately as cProfile sees only CPU time of the driver
+CATEGORIES = (
+    ('db_cpu', ('asyncpg', 'asyncpgsa', 'sqlalchemy', 'memory_db')),
+    ('serialization', ('json',)),
+    ('io_wait', ('selectors', 'select')),
+)
+
+
+def categorize(filename, function):
+    if filename == '~':
+        # builtins and C extensions carry the module in the function name
+        for category, packages in CATEGORIES:
+            if any(package in function for package in packages):
+                return category
+        return 'handler'
+
+    parts = filename.replace('\\', '/').split('/')
+    for category, packages in CATEGORIES:
+        if any(package in parts or package + '.py' in parts
+               for package in packages):
+            return category
+    return 'handler'
+
+
+def breakdown(stats, db_seconds):
+    """Own time of profiled functions summed by category and wall time
+    spent awaiting the database, in seconds
+    """
+    result = {'handler': 0.0, 'db_cpu': 0.0, 'serialization': 0.0,
+              'io_wait': 0.0}
+    for (filename, _, function), timings in stats.stats.items():
+        result[categorize(filename, function)] += timings[2]
+    result['db'] = db_seconds
+    return {category: round(value, 6) for category, value in result.items()}
+
+
+class TimedBackend:
+    """Storage backend module adding the time its coroutines take to
+    `db_time` of the profiled request, other calls are passed as is.
+    """
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        value = getattr(self._db, name)
+        if inspect.iscoroutinefunction(value):
+            value = self._timed(value)
+        # looked up once, next time the attribute is found on instance
+        setattr(self, name, value)
+        return value
+
+    @staticmethod
+    def _timed(func):
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            timer = db_time.get()
+            if timer is None:
+                return await func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                timer[0] += time.perf_counter() - start
+
+        return wrapper
+
+
+class Profiler:
+    """Keeps the latest profiles of sampled or explicitly requested calls.
+
+    cProfile sees the whole thread, so only one request is profiled at
+    a time, others running concurrently are counted in its numbers.
+    """
+
+    def __init__(self, sample_rate=0.0, header=DEFAULT_HEADER,
+                 keep=DEFAULT_KEEP):
+        self.sample_rate = sample_rate
+        self.header = header
+        self.profiles = deque(maxlen=keep)
+        self.counter = itertools.count(1)
+        self.active = False
+
+    async def should_profile(self, request):
+        """Whether to profile the request, if so the profiler is marked
+        active and the caller has to reset it when done.
+        """
+        if self.active:
+            return False
+        # taken before awaiting the user check, a concurrent request
+        # must not start a second profiler meanwhile
+        self.active = True
+        try:
+            if self.header in request.headers:
+                username = await authorized_userid(request)
+                profile = bool(username) and await BaseView.is_superuser(
+                    request, username)
+            else:
+                profile = (self.sample_rate > 0 and
+                           random.random() < self.sample_rate)
+        except BaseException:
+            self.active = False
+            raise
+        if not profile:
+            self.active = False
+        return profile
+
+    def add(self, request, profile, started, duration, db_seconds):
+        stats = pstats.Stats(profile)
+        self.profiles.append({
+            'id': next(self.counter),
+            'method': request.method,
+            'path': request.path,
+            'started': started,
+            'duration': round(duration, 6),
+            'breakdown': breakdown(stats, round(db_seconds, 6)),
+            # the same format as written by pstats.Stats.dump_stats
+            'stats': marshal.dumps(stats.stats),
+        })
+
+    def get(self, profile_id):
+        for profile in self.profiles:
+            if profile['id'] == profile_id:
+                return profile
+
+
+@web.middleware
+async def profiling_middleware(request, handler):
+    profiler = request.app['profiler']
+    if not await profiler.should_profile(request):
+        return await handler(request)
+
+    timer = [0.0]
+    token = db_time.set(timer)
+    profile = cProfile.Profile()
+    started = time.time()
+    start = time.perf_counter()
+    profile.enable()
+    try:
+        return await handler(request)
+    finally:
+        profile.disable()
+        db_time.reset(token)
+        profiler.active = False
+        profiler.add(request, profile, started, time.perf_counter() - start,
+                     timer[0])
+
+
+class ProfileView(BaseView):
+
+    async def check_superuser(self):
+        username = await authorized_userid(self.request)
+        if not username:
+            raise web.HTTPUnauthorized()
+
+        if not await self.is_superuser(self.request, username):
+            raise web.HTTPForbidden()
+
+    async def get(self):
+        """List collected profiles or download one in pstats format
+        GET /admin/profiles
+        GET /admin/profiles/{id:int}
+        """
+        await self.check_superuser()
+        profiler = self.request.app['profiler']
+        if 'id' not in self.request.match_info:
+            data = [{key: value for key, value in profile.items()
+                     if key != 'stats'} for profile in profiler.profiles]
+            return json_response(data)
+
+        profile = profiler.get(self.get_object_id())
+        if not profile:
+            raise web.HTTPNotFound()
+        filename = 'profile-{}.pstats'.format(profile['id'])
+        return web.Response(
+            body=profile['stats'],
+            content_type='application/octet-stream',
+            headers={'Content-Disposition':
+                     'attachment; filename="{}"'.format(filename)})
+
+
+def setup_profiling(app):
+    """Install profiling hook, nothing is added when it is disabled"""
+    config = app['config'].get('profiling', {})
+    if not config.get('ENABLED', False):
+        return
+
+    app['profiler'] = Profiler(
+        sample_rate=config.get('SAMPLE_RATE', 0.0),
+        header=config.get('HEADER', DEFAULT_HEADER),
+        keep=config.get('KEEP', DEFAULT_KEEP),
+    )
+    # requests reach the backend through app['db'], set up before
+    app['db'] = TimedBackend(app['db'])
+    app.middlewares.append(profiling_middleware)
+    app.router.add_get('/admin/profiles', ProfileView)
+    app.router.add_get('/admin/profiles/{id:\\d+}', ProfileView)
@@ -1,21 +1,30 @@
 from forum.views import (
-    index, TopicView, ThreadView, MessageView, LoginView, LogoutView
+    index, metrics, health_live, health_ready, stats,
+    TopicView, TopicDeletionView, ThreadView, UnreadView,
+    MessageView, MessageBatchView, LoginView, LogoutView
 )
 
 
 def setup_routes(app):
     app.router.add_get('/', index)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_get('/health/live', health_live)
+    app.router.add_get('/health/ready', health_ready)
+    app.router.add_get('/stats', stats)
     app.router.add_get('/topics', TopicView)
     app.router.add_post('/topics', TopicView)
     app.router.add_get('/topics/{id:\d+}', TopicView)
     app.router.add_put('/topics/{id:\d+}', TopicView)
     app.router.add_delete('/topics/{id:\d+}', TopicView)
+    app.router.add_get('/topics/{id:\d+}/deletion', TopicDeletionView)
 
     app.router.add_get('/topics/{id:\d+}/threads', ThreadView)
     app.router.add_post('/topics/{id:\d+}/threads', ThreadView)
+    app.router.add_get('/topics/{id:\d+}/unread', UnreadView)
 
     app.router.add_get('/threads/{id:\d+}/messages', MessageView)
     app.router.add_post('/threads/{id:\d+}/messages', MessageView)
+    app.router.add_get('/messages', MessageBatchView)
 
     app.router.add_post('/login', LoginView)
     app.router.add_get('/logout', LogoutView)
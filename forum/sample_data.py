@@ -0,0 +1,108 @@
+from functools import lru_cache
+
+from forum.models import user, topic, thread, message
+from forum.security import generate_password_hash
+
+
+@lru_cache(maxsize=None)
+def password_hash(password):
+    # bcrypt is slow on purpose, sample passwords are hashed only once
+    return generate_password_hash(password)
+
+
+def sample_data():
+    """Rows of the sample forum as (table, rows) in order of insertion"""
+    return [
+        (user, [
+            {
+                'username': 'admin',
+                'password_hash': password_hash('admin'),
+                'superuser': True
+            },
+            {
+                'username': 'guest',
+                'password_hash': password_hash('guest'),
+                'superuser': False
+            },
+        ]),
+        (topic, [
+            {'name': 'Cinema'},
+            {'name': 'Music'},
+            {'name': 'Sport'},
+        ]),
+        (thread, [
+            {
+                'title': 'Luc Besson cinematography',
+                'topic': 1,
+                'created_at': '2001-01-01 00:00:00'
+            },
+            {
+                'title': 'Madagascar movie',
+                'topic': 1,
+                'created_at': '2001-01-01 00:00:00'
+            },
+            {
+                'title': 'Hard Rock music',
+                'topic': 2,
+                'created_at': '2001-01-01 00:00:00'
+            },
+            {
+                'title': "You'll never walk alone!",
+                'topic': 3,
+                'created_at': '2001-01-01 00:00:00'
+             },
+        ]),
+        # replies go in a separate batch after the message they refer to
+        (message, [
+            {
+                'content': 'Le Grand Bleu - the most wonderful movie',
+                'thread': 1,
+                'parent': None,
+                'starter': True,
+                'created_at': '2001-03-14 11:15:01',
+                'updated_at': '2001-03-14 11:15:01'
+            }
+        ]),
+        (message, [
+            {
+                'content': 'Yes! But Leon is the most dramatic',
+                'thread': 1,
+                'parent': 1,
+                'starter': False,
+                'created_at': '2001-03-14 11:17:12',
+                'updated_at': '2001-03-14 11:17:12'
+            },
+            {
+                'content': 'Remember the Fifth Element',
+                'thread': 1,
+                'parent': None,
+                'starter': False,
+                'created_at': '2001-03-14 11:39:21',
+                'updated_at': '2001-03-14 11:39:21'
+            },
+            {
+                'content': 'Pinguins are coming',
+                'thread': 2,
+                'parent': None,
+                'starter': True,
+                'created_at': '2001-04-21 13:12:21',
+                'updated_at': '2001-04-21 13:12:21'
+            },
+            {
+                'content': 'Hard Rock forever!',
+                'thread': 3,
+                'parent': None,
+                'starter': True,
+                'created_at': '2001-04-21 13:13:21',
+                'updated_at': '2001-04-21 13:13:21'
+            },
+            {
+                'content': 'Liverpool is the champion!!!',
+                'thread': 4,
+                'parent': None,
+                'starter': True,
+                'created_at': '2011-06-01 23:33:21',
+                'updated_at': '2011-06-01 23:33:21'
+            },
+        ]),
+    ]
@@ -1,4 +1,3 @@
-import os
 import pathlib
 import pytoml as toml
 
@@ -6,7 +5,6 @@ BASE_DIR = pathlib.Path(__file__).parent.parent
 
 
 def load_config(path):
-    print(os.getcwd())
     with open(path) as f:
         conf = toml.load(f)
     return conf
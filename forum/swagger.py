@@ -0,0 +1,115 @@
+import hashlib
+from importlib.util import find_spec
+import json
+import logging
+import os
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+
+def default_cache_dir():
+    # per-user directory, a shared one like /tmp lets other local users
+    # plant a spec for the hash of our file
+    base = (os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'shhforum')
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def parse_spec(path):
+    import yaml
+
+    with open(path) as f:
+        return json.dumps(yaml.safe_load(f))
+
+
+def owned(f):
+    """Whether open file belongs to the user running the process"""
+    if not hasattr(os, 'getuid'):
+        return True
+    return os.fstat(f.fileno()).st_uid == os.getuid()
+
+
+def load_spec(path, cache_dir):
+    """Return swagger spec as JSON text, parsing YAML only on cache miss"""
+    cache_path = os.path.join(
+        cache_dir, 'swagger-{}.json'.format(file_hash(path)))
+    try:
+        with open(cache_path) as f:
+            if owned(f):
+                return f.read()
+            log.warning('Ignoring swagger cache %s of another user',
+                        cache_path)
+    except OSError:
+        pass
+
+    spec = parse_spec(path)
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        tmp_path = '{}.{}'.format(cache_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(spec)
+        os.replace(tmp_path, cache_path)
+    except OSError as exc:
+        log.warning('Swagger spec is not cached: %s', exc)
+    return spec
+
+
+class SwaggerDocs:
+    """Swagger UI with the spec loaded on the first request instead of
+    on startup, parsed spec is cached by hash of the YAML file.
+    """
+
+    def __init__(self, spec_path, cache_dir, url, static_path):
+        self.spec_path = spec_path
+        self.cache_dir = cache_dir
+        self.url = url
+        self.static_path = static_path
+        self.spec = None
+        self.home = None
+
+    def load(self):
+        """Parse spec and render home page, no-op after the first call"""
+        if self.spec is None:
+            self.spec = load_spec(self.spec_path, self.cache_dir)
+        if self.home is None:
+            with open(os.path.join(self.static_path, 'index.html')) as f:
+                self.home = f.read().replace(
+                    '##SWAGGER_CONFIG##', self.url + '/swagger.json'
+                ).replace(
+                    '##STATIC_PATH##', self.url + '/swagger_static'
+                ).replace(
+                    '##SWAGGER_VALIDATOR_URL##', ''
+                )
+
+    async def home_view(self, request):
+        self.load()
+        return web.Response(text=self.home, content_type='text/html')
+
+    async def spec_view(self, request):
+        self.load()
+        return web.json_response(text=self.spec)
+
+
+def setup_swagger(app, spec_path, url='/api/doc'):
+    # static files and template are taken from aiohttp_swagger package
+    # without importing it, it eagerly pulls yaml and jinja2
+    package_path = find_spec('aiohttp_swagger').submodule_search_locations[0]
+    static_path = os.path.join(package_path, 'swagger_ui')
+
+    config = app['config'].get('swagger', {})
+    docs = SwaggerDocs(spec_path,
+                       config.get('CACHE_DIR') or default_cache_dir(),
+                       url, static_path)
+    app['swagger'] = docs
+
+    app.router.add_get(url, docs.home_view)
+    app.router.add_get(url + '/', docs.home_view)
+    app.router.add_get(url + '/swagger.json', docs.spec_view)
+    app.router.add_static(url + '/swagger_static', static_path)
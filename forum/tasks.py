@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 0.5
+DEFAULT_SHUTDOWN_TIMEOUT = 10
+
+
+class TaskQueue:
+    """Bounded queue of deferred coroutines executed by a pool of workers.
+
+    Handlers submit non-critical side effects and respond without
+    waiting for them. Failed tasks are retried with exponential backoff,
+    queued tasks are drained when the application shuts down.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS,
+                 queue_size=DEFAULT_QUEUE_SIZE,
+                 retries=DEFAULT_RETRIES,
+                 retry_delay=DEFAULT_RETRY_DELAY,
+                 shutdown_timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        self.workers_count = workers
+        self.queue_size = queue_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.shutdown_timeout = shutdown_timeout
+        self.queue = None
+        self.workers = []
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'dropped': 0,
+            'retried': 0,
+        }
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule `func(*args, **kwargs)` coroutine, never blocks.
+        Returns False if the task was dropped because the queue is full.
+        """
+        if self.queue is None:
+            raise RuntimeError('Task queue is not started')
+        try:
+            self.queue.put_nowait((time.monotonic(), func, args, kwargs))
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            log.warning('Task queue is full, %s dropped', func.__name__)
+            return False
+        self.stats['submitted'] += 1
+        return True
+
+    async def execute(self, func, args, kwargs):
+        for attempt in range(self.retries + 1):
+            try:
+                await func(*args, **kwargs)
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if attempt == self.retries:
+                    log.exception('Task %s failed', func.__name__)
+                    return False
+                self.stats['retried'] += 1
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+    async def worker(self):
+        while True:
+            submitted_at, func, args, kwargs = await self.queue.get()
+            try:
+                succeeded = await self.execute(func, args, kwargs)
+                self.stats['completed' if succeeded else 'failed'] += 1
+                latency = time.monotonic() - submitted_at
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+            finally:
+                self.queue.task_done()
+
+    async def start(self):
+        self.queue = asyncio.Queue(self.queue_size)
+        self.workers = [asyncio.ensure_future(self.worker())
+                        for _ in range(self.workers_count)]
+
+    async def stop(self):
+        """Wait for queued tasks to finish, then stop the workers"""
+        try:
+            await asyncio.wait_for(self.queue.join(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            log.warning('Task queue was not drained, %s tasks lost',
+                        self.queue.qsize())
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def metrics(self):
+        finished = self.stats['completed'] + self.stats['failed']
+        return dict(
+            self.stats,
+            depth=self.queue.qsize() if self.queue else 0,
+            workers=len(self.workers),
+            latency_avg=self.latency_total / finished if finished else 0.0,
+            latency_max=self.latency_max,
+        )
+
+
+def setup_tasks(app):
+    config = app['config'].get('tasks', {})
+    tasks = TaskQueue(
+        workers=config.get('WORKERS', DEFAULT_WORKERS),
+        queue_size=config.get('QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+        retries=config.get('RETRIES', DEFAULT_RETRIES),
+        retry_delay=config.get('RETRY_DELAY', DEFAULT_RETRY_DELAY),
+        shutdown_timeout=config.get(
+            'SHUTDOWN_TIMEOUT', DEFAULT_SHUTDOWN_TIMEOUT),
+    )
+    app['tasks'] = tasks
+
+    async def start_tasks(app):
+        await tasks.start()
+
+    async def stop_tasks(app):
+        await tasks.stop()
+
+    app.on_startup.append(start_tasks)
+    app.on_cleanup.append(stop_tasks)
+    app['metrics']['tasks'] = tasks.metrics
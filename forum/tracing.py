@@ -0,0 +1,217 @@
+from collections import deque, Counter
+import contextvars
+import itertools
+import logging
+import time
+
+from aiohttp import web
+from asyncpgsa.connection import SAConnection, compile_query
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SLOW_QUERY_MS = 100
+DEFAULT_REPEATED_QUERY_LIMIT = 10
+DEFAULT_SAMPLES = 1000
+DEFAULT_TOP = 20
+
+# statements executed by the current request, set by tracing middleware
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+# statements of the application, asyncpg sends BEGIN, COMMIT and reset
+# script of released connections through execute too, they have no plan
+PLANNED_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def has_plan(query):
+    """Whether query is a single statement EXPLAIN accepts"""
+    words = query.lstrip(' \n(').split(None, 1)
+    return (bool(words) and words[0].upper() in PLANNED_STATEMENTS and
+            ';' not in query.rstrip().rstrip(';'))
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class StatementStats:
+
+    def __init__(self, samples):
+        self.calls = 0
+        self.total = 0.0
+        self.rows = 0
+        self.timings = deque(maxlen=samples)
+
+    def add(self, duration, rows):
+        self.calls += 1
+        self.total += duration
+        self.rows += rows
+        self.timings.append(duration)
+
+    def to_dict(self):
+        timings = list(self.timings)
+        return {
+            'calls': self.calls,
+            'total_ms': round(self.total * 1000, 3),
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+            'rows': self.rows,
+        }
+
+
+class RequestTrace:
+
+    def __init__(self, request_id, method, path):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.statements = Counter()
+
+    def __str__(self):
+        return '#{} {} {}'.format(self.request_id, self.method, self.path)
+
+
+class QueryTracer:
+    """Timing and row counts of every SQL statement run by the pool.
+
+    Statements slower than the threshold are logged with their params,
+    the request which ran them and their plan, plan is fetched in
+    background through the task queue.
+    """
+
+    def __init__(self, slow_query_ms=DEFAULT_SLOW_QUERY_MS,
+                 explain=True, samples=DEFAULT_SAMPLES):
+        self.slow_query = slow_query_ms / 1000
+        self.explain = explain
+        self.samples = samples
+        self.statements = {}
+        self.pool = None
+        self.tasks = None
+
+    def record(self, query, args, duration, rows):
+        if query.startswith('EXPLAIN '):
+            return
+        if not has_plan(query):
+            # only slow transaction control or reset is worth a note
+            if duration >= self.slow_query:
+                log.warning('Slow statement %.1f ms: %s',
+                            duration * 1000, query)
+            return
+        stats = self.statements.get(query)
+        if stats is None:
+            stats = self.statements[query] = StatementStats(self.samples)
+        stats.add(duration, rows)
+
+        trace = current_trace.get()
+        if trace is not None:
+            trace.statements[query] += 1
+
+        if duration >= self.slow_query:
+            log.warning('Slow query %.1f ms in %s: %s %r',
+                        duration * 1000, trace or 'background', query, args)
+            if self.explain and self.tasks is not None:
+                self.tasks.submit(self.log_plan, query, args)
+
+    async def log_plan(self, query, args):
+        # errors are not raised, task queue would retry it on a fresh
+        # connection each time for nothing but a log line
+        try:
+            async with self.pool.acquire() as conn:
+                # EXPLAIN without ANALYZE does not run the statement itself
+                plan = await conn.fetch('EXPLAIN ' + query, *args)
+        except Exception as exc:
+            log.warning('No plan of slow query: %s: %s', query, exc)
+            return
+        log.warning('Plan of slow query: %s\n%s', query,
+                    '\n'.join(row[0] for row in plan))
+
+    def metrics(self, top=DEFAULT_TOP):
+        statements = sorted(self.statements.items(),
+                            key=lambda item: item[1].total, reverse=True)
+        return [dict(stats.to_dict(), query=query)
+                for query, stats in statements[:top]]
+
+
+class TracingConnection(SAConnection):
+    """Connection reporting every statement to `tracer` of the class"""
+    tracer = None
+
+    def compile(self, query, args):
+        query, params = compile_query(query, dialect=self._dialect)
+        return query, params or args
+
+    async def trace(self, method, query, args, kwargs, count_rows):
+        query, args = self.compile(query, args)
+        rows = 0
+        start = time.perf_counter()
+        # failed statements are recorded too, a query cancelled by
+        # statement_timeout is the slowest one
+        try:
+            result = await method(self, query, *args, **kwargs)
+            rows = count_rows(result)
+            return result
+        finally:
+            self.tracer.record(query, args, time.perf_counter() - start,
+                               rows)
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self.trace(SAConnection.fetch, query, args, kwargs, len)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self.trace(SAConnection.fetchrow, query, args, kwargs,
+                                lambda row: 0 if row is None else 1)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self.trace(SAConnection.fetchval, query, args, kwargs,
+                                lambda value: 1)
+
+    async def execute(self, query, *args, **kwargs):
+        # status looks like "INSERT 0 1", the last number is rows count
+        return await self.trace(
+            SAConnection.execute, query, args, kwargs,
+            lambda status: int(status.rsplit(' ', 1)[-1])
+            if status and status[-1].isdigit() else 0)
+
+
+def tracing_connection_class(tracer):
+    return type('TracingConnection', (TracingConnection,), {'tracer': tracer})
+
+
+def tracing_middleware(repeated_query_limit):
+    request_ids = itertools.count(1)
+
+    @web.middleware
+    async def middleware(request, handler):
+        trace = RequestTrace(next(request_ids), request.method, request.path)
+        token = current_trace.set(trace)
+        try:
+            return await handler(request)
+        finally:
+            current_trace.reset(token)
+            for query, count in trace.statements.items():
+                if count >= repeated_query_limit:
+                    log.warning('Query repeated %s times in %s, N+1?: %s',
+                                count, trace, query)
+
+    return middleware
+
+
+def setup_tracing(app):
+    """Create tracer used by `init_db` for the pool connections"""
+    config = app['config'].get('tracing', {})
+    if not config.get('ENABLED', False):
+        return None
+
+    tracer = QueryTracer(
+        slow_query_ms=config.get('SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS),
+        explain=config.get('EXPLAIN', True),
+    )
+    tracer.tasks = app['tasks']
+    app['query_tracer'] = tracer
+    app['metrics']['queries'] = tracer.metrics
+    app.middlewares.append(tracing_middleware(
+        config.get('REPEATED_QUERY_LIMIT', DEFAULT_REPEATED_QUERY_LIMIT)))
+    return tracer
@@ -6,8 +6,10 @@ from aiohttp import web
 from aiohttp.web import json_response
 from aiohttp_security import remember, forget, authorized_userid
 import asyncpg
+from sqlalchemy import Column
 
-from forum import db
+from forum import models
+from forum.deletion import start_topic_deletion
 from forum.security import check_password_hash
 
 log = logging.getLogger(__name__)
@@ -26,8 +28,105 @@ def json_encoder(data):
     return json.dumps(data, default=encoder)
 
 
+async def metrics(request):
+    """Internal metrics of the application subsystems"""
+    data = {name: collect()
+            for name, collect in request.app['metrics'].items()}
+    return json_response(data)
+
+
+async def stats(request):
+    """Thread and message counts of every topic and of the whole forum"""
+    conn = await request['db_context'].connection()
+    result = await request.app['db'].get_stats(conn)
+    topics = list(map(dict, result))
+    return json_response({
+        'threads': sum(item['threads'] for item in topics),
+        'messages': sum(item['messages'] for item in topics),
+        'topics': topics,
+    })
+
+
+async def report_created(kind, object_id, parent_id):
+    """Deferred side effects of a created thread or message"""
+    log.info('%s %s created in %s', kind, object_id, parent_id)
+
+
+class ThreadPage(bytes):
+    """Serialized messages of thread with id of the last one"""
+    last_id = None
+
+
+async def get_thread_page(app, thread_id, connection=None):
+    """Serialized messages of thread from cache, None if there are none.
+    Inside a request `connection` gives the connection of the request,
+    it must not wait for another one from pool holding its own already.
+    """
+    async def load_page():
+        if connection is not None:
+            result = await app['db'].get_messages_by_thread_id(
+                await connection(), thread_id)
+        else:
+            # warm-up loads pages outside of requests
+            async with app['db_pool'].acquire() as conn:
+                result = await app['db'].get_messages_by_thread_id(
+                    conn, thread_id)
+        if result:
+            data = list(map(dict, result))
+            page = ThreadPage(json_encoder(data).encode('utf-8'))
+            page.last_id = result[-1]['id']
+            return page
+
+    return await app['thread_cache'].get_or_load(thread_id, load_page)
+
+
+async def health_live(request):
+    """Process is up and serving requests"""
+    return json_response({'status': 'ok'})
+
+
+async def health_ready(request):
+    """Warm-up is done, traffic can be routed to this instance"""
+    if not request.app['readiness']['ready']:
+        return json_response({'status': 'warming up'}, status=503)
+    return json_response({'status': 'ok'})
+
+
+def compile_schema(schema, text_max_length):
+    """Turn body schema into (name, type, max length, nullable) tuples.
+    Field is described by a table column or by (type, max length) pair.
+    """
+    fields = []
+    for name, field in schema.items():
+        if isinstance(field, Column):
+            kind = field.type.python_type
+            max_length = getattr(field.type, 'length', None)
+            nullable = field.nullable
+        else:
+            kind, max_length = field
+            nullable = False
+        if kind is str and max_length is None:
+            max_length = text_max_length
+        fields.append((name, kind, max_length, nullable))
+    return tuple(fields)
+
+
 class BaseView(web.View):
     REQUIRED = ()
+    SCHEMA = {}
+    fields = ()
+    TEXT_MAX_LENGTH = 10000
+    DEFAULT_BODY_SIZE = 64 * 1024
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # schema is compiled once per view, not on every request
+        cls.fields = compile_schema(cls.SCHEMA, cls.TEXT_MAX_LENGTH)
+
+    @property
+    def db(self):
+        """Storage backend selected in config"""
+        return self.request.app['db']
 
     def get_object_id(self):
         """Get and validate identifier from url"""
@@ -37,11 +136,47 @@ class BaseView(web.View):
             raise web.HTTPBadRequest()
         return object_id
 
+    def get_body_limit(self):
+        """Body size limit of the route from config or the default one"""
+        config = self.request.app['config'].get('limits', {})
+        route = self.request.match_info.route.resource.canonical
+        return config.get('body_size', {}).get(
+            route, config.get('DEFAULT_BODY_SIZE', self.DEFAULT_BODY_SIZE))
+
+    async def read_body(self):
+        """Read request body, stop as soon as it exceeds the limit"""
+        limit = self.get_body_limit()
+        length = self.request.content_length
+        if length is not None and length > limit:
+            raise web.HTTPRequestEntityTooLarge(limit, length)
+
+        body = bytearray()
+        async for chunk in self.request.content.iter_any():
+            body.extend(chunk)
+            if len(body) > limit:
+                raise web.HTTPRequestEntityTooLarge(limit, len(body))
+        return bytes(body)
+
+    def validate(self, data):
+        """Check types and lengths of fields against view schema"""
+        for name, kind, max_length, nullable in self.fields:
+            if name not in data:
+                continue
+            value = data[name]
+            if value is None and nullable and name not in self.REQUIRED:
+                continue
+            # exact type check, so True is not accepted as an integer
+            if type(value) is not kind:
+                raise web.HTTPBadRequest()
+            if max_length is not None and len(value) > max_length:
+                raise web.HTTPBadRequest()
+
     async def get_body_params(self):
         """Validate incoming JSON params"""
+        body = await self.read_body()
         try:
-            data = await self.request.json()
-        except json.decoder.JSONDecodeError:
+            data = json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, json.decoder.JSONDecodeError):
             raise web.HTTPBadRequest()
 
         if not isinstance(data, dict):
@@ -49,14 +184,23 @@ class BaseView(web.View):
 
         if not all(item in data for item in self.REQUIRED):
             raise web.HTTPBadRequest()
+
+        self.validate(data)
         return data
 
+    async def connection(self):
+        """Connection of the request, taken from pool on first use"""
+        return await self.request['db_context'].connection()
+
+    async def get_user(self, username):
+        """User row, already fetched by the security policy"""
+        return await self.request['db_context'].get_user(username)
+
     @staticmethod
     async def is_superuser(request, username):
         """Check if current user is admin"""
-        async with request.app['db_pool'].acquire() as conn:
-            user = await db.get_user_by_name(conn, username)
-            return user['superuser']
+        user = await request['db_context'].get_user(username)
+        return user['superuser']
 
     @staticmethod
     def ok_response(status=200):
@@ -66,23 +210,24 @@ class BaseView(web.View):
 
 class TopicView(BaseView):
     REQUIRED = ('name',)
+    SCHEMA = {'name': models.topic.c.name}
 
     async def get(self):
         """Get all topics or get topic by id
         GET /topics
         """
         topic_id = self.request.match_info.get('id')
-        async with self.request.app['db_pool'].acquire() as conn:
-            if not topic_id:
-                result = await db.get_topics(conn)
-                data = list(map(dict, result))
-                return json_response(data, dumps=json_encoder)
-
-            topic_id = self.get_object_id()
-            data = await db.get_topic_by_id(conn, topic_id)
-            if not data:
-                raise web.HTTPNotFound()
-            return json_response(dict(data))
+        conn = await self.connection()
+        if not topic_id:
+            result = await self.db.get_topics(conn)
+            data = list(map(dict, result))
+            return json_response(data, dumps=json_encoder)
+
+        topic_id = self.get_object_id()
+        data = await self.db.get_topic_by_id(conn, topic_id)
+        if not data:
+            raise web.HTTPNotFound()
+        return json_response(dict(data))
 
     async def post(self):
         """Add new topic
@@ -91,6 +236,8 @@ class TopicView(BaseView):
           "name": "string"
         }
         """
+        # body is read before auth takes a connection for the request
+        data = await self.get_body_params()
         username = await authorized_userid(self.request)
         if not username:
             raise web.HTTPUnauthorized()
@@ -98,15 +245,16 @@ class TopicView(BaseView):
         if not await self.is_superuser(self.request, username):
             raise web.HTTPForbidden()
 
-        data = await self.get_body_params()
-        async with self.request.app['db_pool'].acquire() as conn:
-            await db.create_topic(conn, data['name'])
+        conn = await self.connection()
+        await self.db.create_topic(conn, data['name'])
         return self.ok_response(201)
 
     async def put(self):
         """Update topic by id
         PUT /topics/{id:int}
         """
+        topic_id = self.get_object_id()
+        data = await self.get_body_params()
         username = await authorized_userid(self.request)
         if not username:
             raise web.HTTPUnauthorized()
@@ -114,10 +262,8 @@ class TopicView(BaseView):
         if not await self.is_superuser(self.request, username):
             raise web.HTTPForbidden()
 
-        topic_id = self.get_object_id()
-        data = await self.get_body_params()
-        async with self.request.app['db_pool'].acquire() as conn:
-            await db.update_topic(conn, topic_id, data['name'])
+        conn = await self.connection()
+        await self.db.update_topic(conn, topic_id, data['name'])
         return self.ok_response()
 
     async def delete(self):
@@ -132,26 +278,57 @@ class TopicView(BaseView):
             raise web.HTTPForbidden()
 
         topic_id = self.get_object_id()
-        async with self.request.app['db_pool'].acquire() as conn:
-            await db.delete_topic(conn, topic_id)
+        conn = await self.connection()
+        topic_ids = await self.db.hide_topic(conn, topic_id)
+        # topic is hidden at once, content is removed in background
+        if topic_ids:
+            thread_cache = self.request.app['thread_cache']
+            for thread_id in await self.db.get_thread_ids_by_topic_ids(
+                    conn, topic_ids):
+                thread_cache.invalidate(thread_id)
+            start_topic_deletion(self.request.app, topic_id, topic_ids)
         return self.ok_response()
 
 
+class TopicDeletionView(BaseView):
+
+    async def get(self):
+        """Get progress of background topic deletion
+        GET /topics/{id:int}/deletion
+        """
+        username = await authorized_userid(self.request)
+        if not username:
+            raise web.HTTPUnauthorized()
+
+        if not await self.is_superuser(self.request, username):
+            raise web.HTTPForbidden()
+
+        topic_id = self.get_object_id()
+        job = self.request.app['topic_deletions'].get(topic_id)
+        if not job:
+            raise web.HTTPNotFound()
+        return json_response(job.to_dict())
+
+
 class ThreadView(BaseView):
     REQUIRED = ('title', 'content')
+    SCHEMA = {
+        'title': models.thread.c.title,
+        'content': models.message.c.content,
+    }
 
     async def get(self):
         """Get all threads by topic id
         GET /topics/{id:int}/threads
         """
         topic_id = self.get_object_id()
-        async with self.request.app['db_pool'].acquire() as conn:
-            result = await db.get_threads_by_topic_id(conn, topic_id)
-            if not result:
-                raise web.HTTPNotFound()
+        conn = await self.connection()
+        result = await self.db.get_threads_by_topic_id(conn, topic_id)
+        if not result:
+            raise web.HTTPNotFound()
 
-            data = list(map(dict, result))
-            return json_response(data, dumps=json_encoder)
+        data = list(map(dict, result))
+        return json_response(data, dumps=json_encoder)
 
     async def post(self):
         """Create a new thread in topic
@@ -163,41 +340,73 @@ class ThreadView(BaseView):
         """
         topic_id = self.get_object_id()
         data = await self.get_body_params()
-        async with self.request.app['db_pool'].acquire() as conn:
-            try:
-                async with conn.transaction():
-                    thread = await db.create_thread(
-                        conn,
-                        data['title'],
-                        topic_id
-                    )
-                    await db.create_message(
-                        conn,
-                        data['content'],
-                        thread['id'],
-                        starter=True
-                    )
-            except asyncpg.exceptions.PostgresError as exc:
-                log.error(exc)
-                return web.HTTPBadRequest()
+        conn = await self.connection()
+        try:
+            async with conn.transaction():
+                thread = await self.db.create_thread(
+                    conn,
+                    data['title'],
+                    topic_id
+                )
+                if thread is None:
+                    raise web.HTTPNotFound()
+                await self.db.create_message(
+                    conn,
+                    data['content'],
+                    thread['id'],
+                    starter=True
+                )
+        except asyncpg.exceptions.PostgresError as exc:
+            log.error(exc)
+            return web.HTTPBadRequest()
+        self.request.app['tasks'].submit(
+            report_created, 'thread', thread['id'], topic_id)
         return self.ok_response(201)
 
 
+class UnreadView(BaseView):
+
+    async def get(self):
+        """Get number of unread messages in every thread of topic
+        GET /topics/{id:int}/unread
+        """
+        username = await authorized_userid(self.request)
+        if not username:
+            raise web.HTTPUnauthorized()
+
+        topic_id = self.get_object_id()
+        user = await self.get_user(username)
+        conn = await self.connection()
+        # counts have to include markers still waiting in the buffer
+        await self.request.app['read_markers'].flush_user(conn, user['id'])
+        result = await self.db.get_unread_counts(conn, user['id'], topic_id)
+        return json_response(list(map(dict, result)))
+
+
 class MessageView(BaseView):
     REQUIRED = ('content',)
+    SCHEMA = {
+        'content': models.message.c.content,
+        'parent': models.message.c.parent,
+    }
 
     async def get(self):
         """Get all messages by thread id
         GET /threads/{id:int}/messages
         """
         thread_id = self.get_object_id()
-        async with self.request.app['db_pool'].acquire() as conn:
-            result = await db.get_messages_by_thread_id(conn, thread_id)
-            if not result:
-                raise web.HTTPNotFound()
+        page = await get_thread_page(self.request.app, thread_id,
+                                     self.connection)
+        if page is None:
+            raise web.HTTPNotFound()
 
-            data = list(map(dict, result))
-            return json_response(data, dumps=json_encoder)
+        username = await authorized_userid(self.request)
+        if username:
+            user = await self.get_user(username)
+            self.request.app['read_markers'].mark(
+                user['id'], thread_id, page.last_id)
+        return web.Response(body=page, content_type='application/json',
+                            charset='utf-8')
 
     async def post(self):
         """Add new message to thread
@@ -209,23 +418,67 @@ class MessageView(BaseView):
         """
         thread_id = self.get_object_id()
         data = await self.get_body_params()
-        async with self.request.app['db_pool'].acquire() as conn:
-            try:
-                await db.create_message(
-                    conn,
-                    data['content'],
-                    thread_id,
-                    starter=False,
-                    parent=data.get('parent')
-                )
-            except asyncpg.exceptions.PostgresError as exc:
-                log.error(exc)
-                return web.HTTPBadRequest()
+        conn = await self.connection()
+        try:
+            message = await self.db.create_message(
+                conn,
+                data['content'],
+                thread_id,
+                starter=False,
+                parent=data.get('parent')
+            )
+        except asyncpg.exceptions.PostgresError as exc:
+            log.error(exc)
+            return web.HTTPBadRequest()
+        if message is None:
+            raise web.HTTPNotFound()
+        self.request.app['thread_cache'].invalidate(thread_id)
+        self.request.app['tasks'].submit(
+            report_created, 'message', message['id'], thread_id)
         return self.ok_response(201)
 
 
+class MessageBatchView(BaseView):
+    MAX_THREADS = 100
+    MAX_PER_THREAD = 100
+    DEFAULT_PER_THREAD = 5
+
+    def get_query_params(self):
+        """Validate thread ids and page size from query string"""
+        query = self.request.query
+        try:
+            thread_ids = [int(item) for item in query['threads'].split(',')]
+            per_thread = int(query.get('per_thread', self.DEFAULT_PER_THREAD))
+        except (KeyError, ValueError):
+            raise web.HTTPBadRequest()
+
+        if not 0 < len(thread_ids) <= self.MAX_THREADS:
+            raise web.HTTPBadRequest()
+        if not 0 < per_thread <= self.MAX_PER_THREAD:
+            raise web.HTTPBadRequest()
+        return thread_ids, per_thread
+
+    async def get(self):
+        """Get first messages of several threads grouped by thread id
+        GET /messages?threads=1,2,3&per_thread=5
+        """
+        thread_ids, per_thread = self.get_query_params()
+        conn = await self.connection()
+        result = await self.db.get_messages_by_thread_ids(
+            conn, thread_ids, per_thread)
+
+        data = {str(thread_id): [] for thread_id in thread_ids}
+        for row in result:
+            data[str(row['thread'])].append(dict(row))
+        return json_response(data, dumps=json_encoder)
+
+
 class LoginView(BaseView):
     REQUIRED = ('username', 'password')
+    SCHEMA = {
+        'username': models.user.c.username,
+        'password': (str, 128),
+    }
 
     async def post(self):
         """Log in for privileged access
@@ -234,21 +487,19 @@ class LoginView(BaseView):
           "password": "string"
         }
         """
+        data = await self.get_body_params()
         username = await authorized_userid(self.request)
         if username:
             return json_response({'error': 'User has already logged in'})
 
-        data = await self.get_body_params()
         username = data['username']
-        async with self.request.app['db_pool'].acquire() as conn:
-            user = await db.get_user_by_name(conn, username)
-
-            if not user or not check_password_hash(
-                    data['password'], user['password_hash']):
-                return json_response(
-                    {'error': 'Invalid username or password'})
+        user = await self.get_user(username)
+        if not user or not check_password_hash(
+                data['password'], user['password_hash']):
+            return json_response(
+                {'error': 'Invalid username or password'})
 
-            await remember(self.request, web.Response(), username)
+        await remember(self.request, web.Response(), username)
         return self.ok_response()
 
 
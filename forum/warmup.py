@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+from forum.views import get_thread_page
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WARM_THREADS = 20
+RETRY_DELAY = 1.0
+
+# read queries of the request path with arguments matching nothing,
+# running them fills statement cache and type codecs of a connection
+HOT_STATEMENTS = (
+    lambda db, conn: db.get_user_by_name(conn, ''),
+    lambda db, conn: db.get_topics(conn),
+    lambda db, conn: db.get_topic_by_id(conn, 0),
+    lambda db, conn: db.get_threads_by_topic_id(conn, 0),
+    lambda db, conn: db.get_messages_by_thread_id(conn, 0),
+    lambda db, conn: db.get_messages_by_thread_ids(conn, [0], 1),
+    lambda db, conn: db.get_unread_counts(conn, 0, 0),
+    lambda db, conn: db.get_stats(conn),
+)
+
+
+async def warm_up_connection(db, conn):
+    for statement in HOT_STATEMENTS:
+        await statement(db, conn)
+
+
+async def warm_up(app):
+    """Open and prepare pool connections, prime the caches"""
+    pool = app['db_pool']
+    # all connections are held at once so each of them is warmed up
+    connections = []
+    try:
+        # taken inside try, failed acquire releases those already held
+        for _ in range(app['db_min_size']):
+            connections.append(await pool.acquire())
+        await asyncio.gather(*(warm_up_connection(app['db'], conn)
+                               for conn in connections))
+    finally:
+        for conn in connections:
+            await pool.release(conn)
+
+    app['swagger'].load()
+
+    config = app['config'].get('warmup', {})
+    async with pool.acquire() as conn:
+        thread_ids = await app['db'].get_latest_thread_ids(
+            conn, config.get('WARM_THREADS', DEFAULT_WARM_THREADS))
+    for thread_id in thread_ids:
+        await get_thread_page(app, thread_id)
+
+
+async def warm_up_until_ready(app):
+    while True:
+        try:
+            await warm_up(app)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception('Warm-up failed, retrying')
+            await asyncio.sleep(RETRY_DELAY)
+        else:
+            app['readiness']['ready'] = True
+            log.info('Warm-up is done, ready to serve')
+            return
+
+
+def setup_warmup(app):
+    """Warm up in background after startup, /health/ready reports
+    when it is done, so balancer routes traffic to a warm instance.
+    """
+    # items of a started app must not be replaced, flag is kept in a holder
+    app['readiness'] = {'ready': False}
+
+    async def start_warmup(app):
+        app['warmup'] = asyncio.ensure_future(warm_up_until_ready(app))
+
+    async def not_ready(app):
+        # balancer stops sending new requests while server shuts down
+        app['readiness']['ready'] = False
+
+    async def stop_warmup(app):
+        app['warmup'].cancel()
+        await asyncio.gather(app['warmup'], return_exceptions=True)
+
+    app.on_startup.append(start_warmup)
+    app.on_shutdown.append(not_ready)
+    app.on_cleanup.append(stop_warmup)
@@ -1,3 +1,5 @@
+import os
+
 import pytest
 
 from forum.main import init_app
@@ -7,16 +9,30 @@ from db_helpers import (
     create_tables, create_sample_data, drop_tables
 )
 
+# FORUM_TEST_BACKEND=memory runs the suite without PostgreSQL
+BACKEND = os.environ.get('FORUM_TEST_BACKEND', 'postgres')
+
+
+def load_test_config():
+    config = load_config(BASE_DIR / 'config' / 'test_config.toml')
+    if BACKEND == 'memory':
+        # every app gets its own store filled with the sample data
+        config['database'].update(BACKEND='memory', SAMPLE_DATA=True)
+    return config
+
 
 @pytest.fixture
 async def client(aiohttp_client):
-    config = load_config(BASE_DIR / 'config' / 'test_config.toml')
-    app = await init_app(config)
+    app = await init_app(load_test_config())
     return await aiohttp_client(app)
 
 
 @pytest.fixture(scope='session')
 def database():
+    if BACKEND == 'memory':
+        yield
+        return
+
     admin_db_config = load_config(
         BASE_DIR / 'config' / 'admin_config.toml')['database']
     test_db_config = load_config(
@@ -29,6 +45,10 @@ def database():
 
 @pytest.fixture()
 def tables_and_data(database):
+    if BACKEND == 'memory':
+        yield
+        return
+
     test_db_config = load_config(
         BASE_DIR / 'config' / 'test_config.toml')['database']
 
@@ -0,0 +1,47 @@
+import asyncio
+
+from forum.cache import PageCache
+
+
+def test_page_cache_evicts_least_recently_used():
+    cache = PageCache(max_size=6)
+    cache.put(1, b'aa')
+    cache.put(2, b'bb')
+    cache.put(3, b'cc')
+    assert cache.get(1) == b'aa'
+
+    cache.put(4, b'dd')
+    assert cache.get(2) is None
+    assert cache.get(1) == b'aa'
+    assert cache.size == 6
+    assert cache.metrics()['evictions'] == 1
+
+
+async def test_page_cache_single_flight():
+    loads = []
+
+    async def load():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return b'page'
+
+    cache = PageCache()
+    pages = await asyncio.gather(
+        *[cache.get_or_load(1, load) for _ in range(5)])
+
+    assert pages == [b'page'] * 5
+    assert len(loads) == 1
+    assert cache.metrics()['coalesced'] == 4
+    assert await cache.get_or_load(1, load) == b'page'
+    assert cache.metrics()['hits'] == 1
+
+
+async def test_page_cache_invalidated_during_load():
+    cache = PageCache()
+
+    async def load():
+        cache.invalidate(1)
+        return b'stale'
+
+    assert await cache.get_or_load(1, load) == b'stale'
+    assert cache.get(1) is None
@@ -1,7 +1,19 @@
+import asyncio
+import marshal
+
+import pytest
+
+from db_helpers import archive_threads, get_engine, reconcile_stats
+from forum.main import init_app
 from forum.security import (
     generate_password_hash,
     check_password_hash
 )
+from forum.settings import load_config, BASE_DIR
+from tests.conftest import BACKEND, load_test_config
+
+requires_postgres = pytest.mark.skipif(
+    BACKEND != 'postgres', reason='runs SQL on the database directly')
 
 
 async def login_admin(client):
@@ -20,6 +32,122 @@ async def test_index_view(tables_and_data, client):
     assert resp.status == 200
 
 
+async def test_health_views(tables_and_data, client):
+    resp = await client.get('/health/live')
+    assert resp.status == 200
+
+    for _ in range(50):
+        resp = await client.get('/health/ready')
+        if resp.status == 200:
+            break
+        assert resp.status == 503
+        await asyncio.sleep(0.1)
+    assert await resp.json() == {'status': 'ok'}
+
+
+async def test_swagger_spec(tables_and_data, client):
+    resp = await client.get('/api/doc/swagger.json')
+    assert resp.status == 200
+    spec = await resp.json()
+    assert '/topics' in spec['paths']
+
+
+async def test_metrics_view(tables_and_data, client):
+    data = {
+        'title': 'Top 100 horrors',
+        'content': 'I like scream!'
+    }
+    await client.post('/topics/1/threads', json=data)
+    resp = await client.get('/metrics')
+    assert resp.status == 200
+    metrics = await resp.json()
+    assert metrics['tasks']['submitted'] == 1
+
+
+async def test_stats_view(tables_and_data, client):
+    resp = await client.get('/stats')
+    assert resp.status == 200
+    assert await resp.json() == {
+        'threads': 4,
+        'messages': 6,
+        'topics': [
+            {'topic': 1, 'threads': 2, 'messages': 4},
+            {'topic': 2, 'threads': 1, 'messages': 1},
+            {'topic': 3, 'threads': 1, 'messages': 1},
+        ]
+    }
+
+    data = {'title': 'Top 100 horrors', 'content': 'I like scream!'}
+    await client.post('/topics/2/threads', json=data)
+    await client.post('/threads/1/messages', json={'content': 'Yes'})
+    await client.post('/threads/10/messages', json={'content': 'No'})
+    await login_admin(client)
+    await client.delete('/topics/3')
+
+    resp = await client.get('/stats')
+    assert await resp.json() == {
+        'threads': 4,
+        'messages': 7,
+        'topics': [
+            {'topic': 1, 'threads': 2, 'messages': 5},
+            {'topic': 2, 'threads': 2, 'messages': 2},
+        ]
+    }
+
+
+@requires_postgres
+async def test_reconcile_stats(tables_and_data, client):
+    test_db_config = load_config(
+        BASE_DIR / 'config' / 'test_config.toml')['database']
+    with get_engine(test_db_config).connect() as conn:
+        conn.execute("UPDATE topic_stats SET messages = 0 WHERE topic = 1")
+    assert reconcile_stats(target_config=test_db_config) == 1
+    assert reconcile_stats(target_config=test_db_config) == 0
+
+    resp = await client.get('/stats')
+    assert (await resp.json())['messages'] == 6
+
+
+async def test_request_shares_connection(tables_and_data, client):
+    await login_admin(client)
+    resp = await client.get('/metrics')
+    before = (await resp.json())['db_context']
+
+    # auth, permission check and the insert run on one connection
+    resp = await client.post('/topics', json={'name': 'Games'})
+    assert resp.status == 201
+    resp = await client.get('/metrics')
+    after = (await resp.json())['db_context']
+    assert after['requests'] - before['requests'] == 2
+    assert after['acquired'] - before['acquired'] == 1
+
+
+async def test_request_needs_one_connection(tables_and_data, aiohttp_client):
+    config = load_test_config()
+    config['database'].update(POOL_MIN_SIZE=1, POOL_MAX_SIZE=1)
+    client = await aiohttp_client(await init_app(config))
+    await login_admin(client)
+
+    async def requests():
+        # new message drops the page warmed up in cache
+        resp = await client.post('/threads/1/messages',
+                                 json={'content': 'Reply'})
+        assert resp.status == 201
+        # auth of profiling takes the connection before the page loads
+        resp = await client.get('/threads/1/messages',
+                                headers={'X-Profile': '1'})
+        assert resp.status == 200
+        resp = await client.get('/topics/1/unread')
+        assert await resp.json() == [
+            {'thread': 1, 'unread': 0},
+            {'thread': 2, 'unread': 1},
+        ]
+        resp = await client.post('/topics', json={'name': 'Games'})
+        assert resp.status == 201
+
+    await asyncio.wait_for(requests(), timeout=10)
+
+
 async def test_topic_view_get(tables_and_data, client):
     resp = await client.get('/topics')
     expected = [
@@ -69,6 +197,12 @@ async def test_topic_view_post_bad_request(tables_and_data, client):
     assert resp.status == 400
 
 
+async def test_topic_view_post_name_too_long(tables_and_data, client):
+    await login_admin(client)
+    resp = await client.post('/topics', json={'name': 'F' * 65})
+    assert resp.status == 400
+
+
 async def test_topic_view_put(tables_and_data, client):
     await login_admin(client)
     resp = await client.put('/topics/3', json={'name': 'Sports'})
@@ -103,6 +237,106 @@ async def test_topic_view_delete_not_found(tables_and_data, client):
     assert await resp.json() == {'result': 'ok'}
 
 
+async def test_topic_view_delete_with_content(tables_and_data, client):
+    await login_admin(client)
+    resp = await client.get('/threads/1/messages')
+    assert len(await resp.json()) == 3
+    resp = await client.delete('/topics/1')
+    assert resp.status == 200
+
+    resp = await client.get('/topics/1')
+    assert resp.status == 404
+    # content of the hidden topic is gone at once, cached page too
+    resp = await client.get('/threads/1/messages')
+    assert resp.status == 404
+    resp = await client.get('/messages?threads=1,3')
+    data = await resp.json()
+    assert data['1'] == []
+    assert [item['id'] for item in data['3']] == [5]
+
+    for _ in range(50):
+        resp = await client.get('/topics/1/deletion')
+        status = await resp.json()
+        if status['status'] == 'done':
+            break
+        await asyncio.sleep(0.1)
+    assert status == {
+        'topic': 1,
+        'status': 'done',
+        'deleted': {'messages': 4, 'threads': 2, 'topics': 1}
+    }
+
+
+async def test_topic_deletion_resumed_on_startup(tables_and_data,
+                                                 aiohttp_client):
+    config = load_test_config()
+    config['deletion']['KEEP_FINISHED'] = 0
+    app = await init_app(config)
+    # topic hidden by a server stopped before its content was deleted
+    async with app['db_pool'].acquire() as conn:
+        await app['db'].hide_topic(conn, 1)
+    await aiohttp_client(app)
+
+    for _ in range(50):
+        await asyncio.sleep(0.1)
+        if app['topic_deletions']:
+            continue
+        async with app['db_pool'].acquire() as conn:
+            if not await app['db'].get_hidden_topic_ids(conn):
+                break
+    async with app['db_pool'].acquire() as conn:
+        assert await app['db'].get_hidden_topic_ids(conn) == []
+        assert await app['db'].get_thread_ids_by_topic_ids(conn, [1], 10) == []
+        assert [row['id'] for row in await app['db'].get_topics(conn)] == [
+            2, 3]
+    # finished job is forgotten
+    assert app['topic_deletions'] == {}
+
+
+async def test_hidden_topic_rejects_content(tables_and_data, client):
+    app = client.server.app
+    async with app['db_pool'].acquire() as conn:
+        await app['db'].hide_topic(conn, 1)
+
+    data = {'title': 'Top 100 horrors', 'content': 'I like scream!'}
+    resp = await client.post('/topics/1/threads', json=data)
+    assert resp.status == 404
+    resp = await client.post('/threads/1/messages', json={'content': 'Yes'})
+    assert resp.status == 404
+    resp = await client.post('/threads/3/messages', json={'content': 'Yes'})
+    assert resp.status == 201
+
+
+async def test_topic_deletion_view_not_found(tables_and_data, client):
+    await login_admin(client)
+    resp = await client.get('/topics/2/deletion')
+    assert resp.status == 404
+
+
+async def test_topic_deletion_view_anonymous(tables_and_data, client):
+    resp = await client.get('/topics/1/deletion')
+    assert resp.status == 401
+
+
+async def test_profile_view(tables_and_data, client):
+    await client.get('/topics', headers={'X-Profile': '1'})
+    resp = await client.get('/admin/profiles')
+    assert resp.status == 401
+
+    await login_admin(client)
+    await client.get('/topics', headers={'X-Profile': '1'})
+    resp = await client.get('/admin/profiles')
+    profiles = await resp.json()
+    assert len(profiles) == 1
+    assert profiles[0]['path'] == '/topics'
+    assert set(profiles[0]['breakdown']) == {
+        'handler', 'db', 'db_cpu', 'serialization', 'io_wait'}
+
+    resp = await client.get('/admin/profiles/{}'.format(profiles[0]['id']))
+    assert resp.status == 200
+    assert marshal.loads(await resp.read())
+
+
 async def test_thread_view_get(tables_and_data, client):
     resp = await client.get('/topics/1/threads')
     expected = [
@@ -147,6 +381,27 @@ async def test_thread_view_post_bad_json(tables_and_data, client):
     assert resp.status == 400
 
 
+async def test_unread_view(tables_and_data, client):
+    resp = await client.get('/topics/1/unread')
+    assert resp.status == 401
+
+    await client.post('/login', json={'username': 'guest',
+                                      'password': 'guest'})
+    resp = await client.get('/topics/1/unread')
+    assert await resp.json() == [
+        {'thread': 1, 'unread': 3},
+        {'thread': 2, 'unread': 1},
+    ]
+
+    await client.get('/threads/1/messages')
+    await client.post('/threads/2/messages', json={'content': 'Yes'})
+    resp = await client.get('/topics/1/unread')
+    assert await resp.json() == [
+        {'thread': 1, 'unread': 0},
+        {'thread': 2, 'unread': 2},
+    ]
+
+
 async def test_message_view_get(tables_and_data, client):
     resp = await client.get('/threads/1/messages')
     expected = [
@@ -182,6 +437,41 @@ async def test_message_view_get(tables_and_data, client):
     assert await resp.json() == expected
 
 
+@requires_postgres
+async def test_message_view_get_archived(tables_and_data, client):
+    test_db_config = load_config(
+        BASE_DIR / 'config' / 'test_config.toml')['database']
+    archived = archive_threads(target_config=test_db_config,
+                               inactive_days=1, batch_delay=0)
+    assert archived == 6
+
+    resp = await client.get('/threads/1/messages')
+    assert resp.status == 200
+    assert [item['id'] for item in await resp.json()] == [1, 2, 3]
+
+    resp = await client.get('/messages?threads=1,2&per_thread=2')
+    data = await resp.json()
+    assert [item['id'] for item in data['1']] == [1, 2]
+    assert [item['id'] for item in data['2']] == [4]
+
+    resp = await client.post('/threads/1/messages',
+                             json={'content': 'Reply', 'parent': 2})
+    assert resp.status == 201
+    resp = await client.post('/threads/1/messages',
+                             json={'content': 'Reply', 'parent': 4})
+    assert resp.status == 400
+    assert archive_threads(target_config=test_db_config,
+                           inactive_days=1, batch_delay=0) == 0
+
+    await client.post('/login', json={'username': 'guest',
+                                      'password': 'guest'})
+    resp = await client.get('/topics/1/unread')
+    assert await resp.json() == [
+        {'thread': 1, 'unread': 4},
+        {'thread': 2, 'unread': 1},
+    ]
+
+
 async def test_message_view_post(tables_and_data, client):
     data = {
         'content': 'We are the champions, my friend...',
@@ -191,6 +481,18 @@ async def test_message_view_post(tables_and_data, client):
     assert await resp.json() == {'result': 'ok'}
 
 
+async def test_message_view_post_invalidates_cache(tables_and_data, client):
+    resp = await client.get('/threads/4/messages')
+    assert len(await resp.json()) == 1
+
+    data = {'content': 'We are the champions, my friend...'}
+    await client.post('/threads/4/messages', json=data)
+
+    resp = await client.get('/threads/4/messages')
+    messages = await resp.json()
+    assert [item['content'] for item in messages][-1] == data['content']
+
+
 async def test_message_view_post_foreign_key_constraint(tables_and_data, client):
     data = {
         'content': ''
@@ -204,6 +506,23 @@ async def test_message_view_post_bad_json(tables_and_data, client):
     assert resp.status == 400
 
 
+async def test_message_batch_view_get(tables_and_data, client):
+    resp = await client.get('/messages?threads=1,2,10&per_thread=2')
+    assert resp.status == 200
+    data = await resp.json()
+    assert [item['id'] for item in data['1']] == [1, 2]
+    assert [item['id'] for item in data['2']] == [4]
+    assert data['10'] == []
+
+
+async def test_message_batch_view_bad_request(tables_and_data, client):
+    resp = await client.get('/messages?threads=1,a')
+    assert resp.status == 400
+
+    resp = await client.get('/messages?threads=1&per_thread=0')
+    assert resp.status == 400
+
+
 async def test_login_view(tables_and_data, client):
     invalid_form = {
         'username': 'user',
@@ -0,0 +1,34 @@
+import json
+import logging
+from unittest import mock
+
+from forum.logs import LogFormatter, JsonAccessLogger
+
+
+def make_request(path):
+    request = mock.Mock(method='GET', path=path, remote='127.0.0.1')
+    request.match_info.route.resource.canonical = path
+    return request
+
+
+def test_log_formatter_writes_access_records_as_json():
+    record = logging.LogRecord('aiohttp.access', logging.INFO, __file__,
+                               1, 'GET /', None, None)
+    record.access = {'method': 'GET', 'status': 200}
+    data = json.loads(LogFormatter().format(record))
+    assert data['method'] == 'GET'
+    assert data['status'] == 200
+    assert 'time' in data
+
+
+def test_access_logger_sampling():
+    logger = mock.Mock()
+    access_logger = JsonAccessLogger(logger, '')
+    access_logger.sampling = {'/threads': 0}
+
+    access_logger.log(make_request('/threads'), mock.Mock(status=200), 0.1)
+    assert not logger.info.called
+
+    access_logger.log(make_request('/threads'), mock.Mock(status=500), 0.1)
+    access_logger.log(make_request('/topics'), mock.Mock(status=200), 0.1)
+    assert logger.info.call_count == 2
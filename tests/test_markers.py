@@ -0,0 +1,40 @@
+import logging
+
+from forum import memory_db
+from forum.markers import ReadMarkers
+from forum.memory_db import MemoryPool, MemoryStore
+from forum.sample_data import sample_data
+
+
+async def test_flush_user_writes_only_own_markers(caplog):
+    store = MemoryStore()
+    store.load(sample_data())
+    pool = MemoryPool(store)
+    markers = ReadMarkers(memory_db, pool)
+    markers.mark(1, 1, 3)
+    markers.mark(2, 1, 2)
+    markers.mark(2, 2, 4)
+
+    async with pool.acquire() as conn:
+        await markers.flush_user(conn, 2)
+        assert sorted(store.tables['read_marker'].rows) == [(2, 1), (2, 2)]
+        assert markers.pending == {(1, 1): 3}
+
+        # failed write is logged, markers are kept for the next flush
+        markers.mark(2, 10, 1)
+        real_write = markers.write
+
+        async def write(conn, batch):
+            raise OSError('connection lost')
+
+        markers.write = write
+        with caplog.at_level(logging.ERROR):
+            await markers.flush_user(conn, 2)
+        assert 'Read markers of user 2 are not saved' in caplog.text
+        assert markers.pending == {(1, 1): 3, (2, 10): 1}
+
+        markers.write = real_write
+        await markers.flush()
+        assert markers.pending == {}
+        assert sorted(store.tables['read_marker'].rows) == [
+            (1, 1), (2, 1), (2, 2)]
@@ -0,0 +1,116 @@
+import inspect
+
+import asyncpg
+import pytest
+
+from forum import db, memory_db
+from forum.memory_db import MemoryPool, MemoryStore
+from forum.sample_data import sample_data
+
+
+def public_functions(module):
+    return {name for name, value in vars(module).items()
+            if inspect.iscoroutinefunction(value)
+            and not name.startswith('_')}
+
+
+def test_memory_backend_implements_db_interface():
+    assert public_functions(db) <= public_functions(memory_db)
+    for name in public_functions(db):
+        assert (inspect.signature(getattr(db, name)).parameters.keys() ==
+                inspect.signature(getattr(memory_db, name)).parameters.keys())
+
+
+@pytest.fixture
+def pool():
+    store = MemoryStore()
+    store.load(sample_data())
+    return MemoryPool(store)
+
+
+async def test_memory_db_constraints(pool):
+    async with pool.acquire() as conn:
+        with pytest.raises(asyncpg.exceptions.UniqueViolationError):
+            await memory_db.create_topic(conn, 'Cinema')
+        with pytest.raises(asyncpg.exceptions.ForeignKeyViolationError):
+            await memory_db.create_thread(conn, 'Title', 10)
+        with pytest.raises(asyncpg.exceptions.ForeignKeyViolationError):
+            await memory_db.create_message(conn, 'Reply', 1, parent=10)
+        with pytest.raises(asyncpg.exceptions.StringDataRightTruncationError):
+            await memory_db.update_topic(conn, 1, 'x' * 65)
+        assert await memory_db.get_latest_thread_ids(conn, 10) == [4, 3, 2, 1]
+
+
+async def test_memory_db_reply_to_archived_message(pool):
+    async with pool.acquire() as conn:
+        row = conn.store.tables['message'].rows[1]
+        conn.delete('message', [2, 3, 1])
+        conn.insert('message_archive', dict(row))
+        message = await memory_db.create_message(conn, 'Reply', 1, parent=1)
+        assert message['id'] == 7
+        # parent has to be in the same thread
+        with pytest.raises(asyncpg.exceptions.ForeignKeyViolationError):
+            await memory_db.create_message(conn, 'Reply', 2, parent=1)
+
+
+async def test_memory_db_unread_counts_archived(pool):
+    async with pool.acquire() as conn:
+        rows = [dict(row) for row in conn.store.tables['message'].lookup(
+            'thread', 1)]
+        conn.delete('message', [row['id'] for row in rows])
+        for row in rows:
+            conn.insert('message_archive', row)
+        await memory_db.create_message(conn, 'Reply', 1)
+        assert await memory_db.get_unread_counts(conn, 2, 1) == [
+            {'thread': 1, 'unread': 4}, {'thread': 2, 'unread': 1}]
+        await memory_db.upsert_read_markers(conn, [2], [1], [2])
+        assert await memory_db.get_unread_counts(conn, 2, 1) == [
+            {'thread': 1, 'unread': 2}, {'thread': 2, 'unread': 1}]
+
+
+async def test_memory_db_transaction_rollback(pool):
+    async with pool.acquire() as conn:
+        with pytest.raises(asyncpg.exceptions.NotNullViolationError):
+            async with conn.transaction():
+                thread = await memory_db.create_thread(conn, 'Title', 1)
+                await memory_db.create_message(conn, None, thread['id'])
+        threads = await memory_db.get_threads_by_topic_id(conn, 1)
+        assert [row['id'] for row in threads] == [1, 2]
+        stats = await memory_db.get_stats(conn)
+        assert stats[0] == {'topic': 1, 'threads': 2, 'messages': 4}
+
+        thread = await memory_db.create_thread(conn, 'Title', 1)
+        assert thread['id'] == 6
+
+
+async def test_memory_db_delete_topic_content(pool):
+    async with pool.acquire() as conn:
+        await memory_db.upsert_read_markers(conn, [2], [1], [3])
+        assert await memory_db.get_hidden_topic_ids(conn) == []
+        assert await memory_db.hide_topic(conn, 1) == [1]
+        assert await memory_db.get_hidden_topic_ids(conn) == [1]
+        assert await memory_db.get_threads_by_topic_id(conn, 1) == []
+        assert await memory_db.get_messages_by_thread_id(conn, 1) == []
+        messages = await memory_db.get_messages_by_thread_ids(conn, [1, 3], 5)
+        assert [row['id'] for row in messages] == [5]
+
+        assert await memory_db.create_thread(conn, 'Title', 1) is None
+        assert await memory_db.create_message(conn, 'Reply', 1) is None
+
+        thread_ids = await memory_db.get_thread_ids_by_topic_ids(conn, [1], 10)
+        assert thread_ids == [1, 2]
+        assert await memory_db.get_thread_ids_by_topic_ids(conn, [1]) == [1, 2]
+        # thread still has messages
+        with pytest.raises(asyncpg.exceptions.ForeignKeyViolationError):
+            await memory_db.delete_threads(conn, thread_ids)
+        # replies go first, so the parent of every message is kept
+        deleted = await memory_db.delete_messages_batch(conn, 1, 2)
+        assert sorted(deleted) == [2, 3]
+        deleted = await memory_db.delete_messages_batch(conn, 1, 2)
+        assert deleted == [1]
+        assert await memory_db.delete_messages_batch(conn, 2, 2) == [4]
+        deleted = await memory_db.delete_threads(conn, thread_ids)
+        assert sorted(deleted) == [1, 2]
+        assert await memory_db.delete_topic(conn, 1) == 1
+        assert await memory_db.get_unread_counts(conn, 2, 1) == []
+        assert not conn.store.tables['read_marker'].rows
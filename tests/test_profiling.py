@@ -0,0 +1,54 @@
+import asyncio
+import types
+
+from aiohttp.test_utils import make_mocked_request
+
+from forum import profiling
+from forum.profiling import Profiler, TimedBackend, db_time
+
+
+async def test_timed_backend_measures_db_await_time():
+
+    async def get_topics(conn):
+        await asyncio.sleep(0.01)
+        return ['Cinema']
+
+    db = TimedBackend(types.SimpleNamespace(get_topics=get_topics, limit=5))
+    assert db.limit == 5
+    # not profiled request is not timed
+    assert await db.get_topics(None) == ['Cinema']
+
+    timer = [0.0]
+    token = db_time.set(timer)
+    try:
+        assert await db.get_topics(None) == ['Cinema']
+    finally:
+        db_time.reset(token)
+    assert timer[0] >= 0.01
+
+
+async def test_one_profiled_request_at_a_time(monkeypatch):
+
+    async def authorized_userid(request):
+        await asyncio.sleep(0)
+        return 'admin'
+
+    async def is_superuser(request, username):
+        return True
+
+    monkeypatch.setattr(profiling, 'authorized_userid', authorized_userid)
+    monkeypatch.setattr(profiling.BaseView, 'is_superuser', is_superuser)
+    profiler = Profiler()
+    requests = [make_mocked_request('GET', '/topics',
+                                    headers={'X-Profile': '1'})
+                for _ in range(2)]
+
+    results = await asyncio.gather(
+        *(profiler.should_profile(request) for request in requests))
+    assert sorted(results) == [False, True]
+    assert profiler.active
+
+    profiler.active = False
+    assert not await profiler.should_profile(
+        make_mocked_request('GET', '/topics'))
+    assert not profiler.active
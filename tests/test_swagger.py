@@ -0,0 +1,27 @@
+import json
+import os
+
+from forum import swagger
+
+SPEC_PATH = os.path.join(os.path.dirname(__file__), '..', 'docs',
+                         'swagger.yaml')
+
+
+def test_load_spec_uses_own_cache(tmp_path, monkeypatch):
+    spec = swagger.load_spec(SPEC_PATH, str(tmp_path))
+    assert 'paths' in json.loads(spec)
+    (cache_path,) = tmp_path.iterdir()
+    cache_path.write_text('{"planted": true}')
+    assert swagger.load_spec(SPEC_PATH, str(tmp_path)) == '{"planted": true}'
+
+    # cache file written by another user is parsed again and replaced
+    monkeypatch.setattr(os, 'getuid', lambda: os.stat(cache_path).st_uid + 1)
+    assert swagger.load_spec(SPEC_PATH, str(tmp_path)) == spec
+
+
+def test_default_cache_dir_is_per_user(monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', '/home/forum/.cache')
+    assert swagger.default_cache_dir() == '/home/forum/.cache/shhforum'
+    monkeypatch.delenv('XDG_CACHE_HOME')
+    monkeypatch.setenv('HOME', '/home/forum')
+    assert swagger.default_cache_dir() == '/home/forum/.cache/shhforum'
@@ -0,0 +1,50 @@
+from forum.tasks import TaskQueue
+
+
+async def test_task_queue_executes_tasks():
+    done = []
+
+    async def task(value):
+        done.append(value)
+
+    tasks = TaskQueue(workers=2)
+    await tasks.start()
+    for value in range(5):
+        assert tasks.submit(task, value)
+    await tasks.stop()
+
+    assert sorted(done) == [0, 1, 2, 3, 4]
+    metrics = tasks.metrics()
+    assert metrics['completed'] == 5
+    assert metrics['depth'] == 0
+
+
+async def test_task_queue_retries_failed_task():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ValueError()
+
+    tasks = TaskQueue(workers=1, retries=2, retry_delay=0)
+    await tasks.start()
+    tasks.submit(flaky)
+    await tasks.stop()
+
+    assert len(attempts) == 3
+    assert tasks.metrics()['retried'] == 2
+    assert tasks.metrics()['completed'] == 1
+
+
+async def test_task_queue_drops_when_full():
+    async def task():
+        pass
+
+    tasks = TaskQueue(workers=0, queue_size=1, shutdown_timeout=0)
+    await tasks.start()
+    assert tasks.submit(task)
+    assert not tasks.submit(task)
+    await tasks.stop()
+
+    assert tasks.metrics()['dropped'] == 1
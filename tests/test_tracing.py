@@ -0,0 +1,90 @@
+import asyncio
+import types
+
+from aiohttp import web
+import pytest
+
+from forum.tracing import (
+    QueryTracer, TracingConnection, current_trace, percentile,
+    tracing_middleware
+)
+
+
+def test_percentile():
+    values = [0.1 * i for i in range(1, 11)]
+    assert percentile([], 0.5) == 0.0
+    assert percentile(values, 0.5) == values[5]
+    assert percentile(values, 0.99) == values[-1]
+
+
+def test_query_tracer_collects_statement_stats():
+    tracer = QueryTracer(slow_query_ms=1000)
+    tracer.record('SELECT 1', [], 0.002, 1)
+    tracer.record('SELECT 1', [], 0.004, 1)
+    tracer.record('SELECT 2', [], 0.001, 3)
+    tracer.record('EXPLAIN SELECT 1', [], 0.001, 3)
+
+    first, second = tracer.metrics()
+    assert first['query'] == 'SELECT 1'
+    assert first['calls'] == 2
+    assert first['rows'] == 2
+    assert first['total_ms'] == 6.0
+    assert second['query'] == 'SELECT 2'
+
+
+async def test_tracing_middleware_links_queries_to_request(
+        aiohttp_client, caplog):
+    tracer = QueryTracer()
+
+    async def handler(request):
+        for _ in range(3):
+            tracer.record('SELECT 1', [], 0.001, 1)
+        return web.Response(text=str(current_trace.get()))
+
+    app = web.Application(middlewares=[tracing_middleware(3)])
+    app.router.add_get('/', handler)
+    client = await aiohttp_client(app)
+
+    resp = await client.get('/')
+    assert await resp.text() == '#1 GET /'
+    assert 'Query repeated 3 times in #1 GET /' in caplog.text
+
+
+def test_query_tracer_skips_statements_without_plan(caplog):
+    tracer = QueryTracer(slow_query_ms=10)
+    tracer.tasks = types.SimpleNamespace(submit=pytest.fail)
+    tracer.record('BEGIN;', [], 0.001, 0)
+    tracer.record('COMMIT;', [], 0.05, 0)
+    tracer.record('SELECT pg_advisory_unlock_all();\nRESET ALL;', [],
+                  0.001, 0)
+    assert tracer.metrics() == []
+    assert 'Slow statement 50.0 ms: COMMIT;' in caplog.text
+
+
+async def test_query_tracer_log_plan_does_not_raise(caplog):
+
+    class Pool:
+        def acquire(self):
+            raise OSError('pool is closed')
+
+    tracer = QueryTracer()
+    tracer.pool = Pool()
+    await tracer.log_plan('SELECT 1', [])
+    assert 'No plan of slow query: SELECT 1: pool is closed' in caplog.text
+
+
+async def test_tracing_connection_records_failed_statement():
+    tracer = QueryTracer(slow_query_ms=1000)
+    conn = types.SimpleNamespace(
+        tracer=tracer, compile=lambda query, args: (query, args))
+
+    async def fetch(self, query, *args):
+        await asyncio.sleep(0)
+        raise asyncio.TimeoutError()
+
+    with pytest.raises(asyncio.TimeoutError):
+        await TracingConnection.trace(conn, fetch, 'SELECT 1', [], {}, len)
+    (stats,) = tracer.metrics()
+    assert stats['query'] == 'SELECT 1'
+    assert stats['calls'] == 1
+    assert stats['rows'] == 0
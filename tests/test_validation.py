@@ -0,0 +1,71 @@
+from aiohttp import web
+
+from forum import models
+from forum.views import BaseView
+
+
+class EchoView(BaseView):
+    REQUIRED = ('content',)
+    SCHEMA = {
+        'title': models.thread.c.title,
+        'content': models.message.c.content,
+        'parent': models.message.c.parent,
+    }
+
+    async def post(self):
+        data = await self.get_body_params()
+        return web.json_response(data)
+
+
+async def make_client(aiohttp_client, limits=None):
+    app = web.Application()
+    app['config'] = {'limits': limits or {}}
+    app.router.add_post('/echo', EchoView)
+    return await aiohttp_client(app)
+
+
+def test_schema_is_compiled_from_columns():
+    assert EchoView.fields == (
+        ('title', str, 64, False),
+        ('content', str, BaseView.TEXT_MAX_LENGTH, False),
+        ('parent', int, None, True),
+    )
+
+
+async def test_valid_body(aiohttp_client):
+    client = await make_client(aiohttp_client)
+    data = {'title': 'a' * 64, 'content': 'text', 'parent': None}
+    resp = await client.post('/echo', json=data)
+    assert resp.status == 200
+    assert await resp.json() == data
+
+
+async def test_invalid_body(aiohttp_client):
+    client = await make_client(aiohttp_client)
+    for data in ({'title': 'a'},
+                 {'content': 1},
+                 {'content': None},
+                 {'content': 'text', 'title': 'a' * 65},
+                 {'content': 'text', 'parent': '1'},
+                 {'content': 'text', 'parent': True}):
+        resp = await client.post('/echo', json=data)
+        assert resp.status == 400, data
+
+    resp = await client.post('/echo', data=b'\xff')
+    assert resp.status == 400
+
+
+async def test_body_size_limit(aiohttp_client):
+    limits = {'DEFAULT_BODY_SIZE': 100, 'body_size': {'/echo': 50}}
+    client = await make_client(aiohttp_client, limits)
+    resp = await client.post('/echo', json={'content': 'a' * 40})
+    assert resp.status == 413
+
+    async def chunks():
+        yield b'{"content": "'
+        yield b'a' * 100
+        yield b'"}'
+
+    # no content length, the limit is checked while reading
+    resp = await client.post('/echo', data=chunks())
+    assert resp.status == 413
@@ -0,0 +1,28 @@
+import pytest
+
+from forum import memory_db
+from forum.memory_db import MemoryPool, MemoryStore
+from forum.warmup import warm_up
+
+
+class FailingPool(MemoryPool):
+    """Pool whose connect fails once `fail_at` connections are taken"""
+
+    def __init__(self, store, max_size, fail_at):
+        super().__init__(store, max_size)
+        self.fail_at = fail_at
+        self.connects = 0
+
+    async def connect(self):
+        self.connects += 1
+        if self.connects == self.fail_at:
+            raise OSError('connection refused')
+        return await super().connect()
+
+
+async def test_warm_up_releases_connections_on_failure():
+    pool = FailingPool(MemoryStore(), max_size=10, fail_at=5)
+    app = {'db': memory_db, 'db_pool': pool, 'db_min_size': 10}
+    with pytest.raises(OSError):
+        await warm_up(app)
+    assert pool.semaphore._value == 10